@@ -1,5 +1,5 @@
 from __future__ import division
-import re, sys
+import re, sys, math, struct, heapq, collections, zlib, hashlib
 
 
 str_type = str if sys.version > '3' else basestring
@@ -99,6 +99,9 @@ for n,v in list(pitch_values.items()):
     for a in '#b':
         pitch_values[n+a] = v + accidental_values[a]
 
+# map ABC accidental symbols to pitch name suffixes
+abc_accidentals = {'^': '#', '^^': '##', '=': '', '_': 'b', '__': 'bb'}
+
 # map chromatic number back to most common key names
 chromatic_notes = ['C', 'C#', 'D', 'Eb', 'E', 'F', 'F#', 'G', 'Ab', 'A', 'Bb', 'B']
 
@@ -110,6 +113,58 @@ mode_values = {'major': 0, 'minor': 3, 'ionian': 0, 'aeolian': 3,
 # mode name normalization
 mode_abbrev = {m[:3]: m for m in mode_values}
 
+# pitch classes of the ionian scale
+ionian_scale = [0, 2, 4, 5, 7, 9, 11]
+
+# modes used for key detection
+detection_modes = ['major', 'dorian', 'phrygian', 'lydian', 'mixolydian', 'minor', 'locrian']
+
+def _key_profile(root, mode):
+    # score weight of each pitch class for a key: +1 for scale notes, -1 for
+    # others, with extra weight on the tonic and its fifth
+    ionian = (root + mode_values[mode]) % 12
+    scale = [(ionian + d) % 12 for d in ionian_scale]
+    profile = [1 if pc in scale else -1 for pc in range(12)]
+    profile[root] += 1
+    if (root + 7) % 12 in scale:
+        profile[(root + 7) % 12] += 0.5
+    return profile
+
+# (root, mode, profile) for every key considered by key detection
+key_profiles = [(root, mode, _key_profile(root, mode)) for mode in detection_modes for root in range(12)]
+
+
+def key_scores(pitch_classes):
+    """Return a list of (score, root, mode) for every key in key_profiles,
+    given the total duration of each of the 12 pitch classes.
+    """
+    used = [(pc, d) for pc, d in enumerate(pitch_classes) if d != 0]
+    return [(sum(profile[pc] * d for pc, d in used), root, mode)
+            for root, mode, profile in key_profiles]
+
+
+def rank_keys(pitch_classes, tonics=()):
+    """Return (score, root, mode) for every key, best first.
+
+    Relative modes (e.g. G major and E minor) differ only in their tonic, so
+    each pitch class in *tonics* (such as the first and last notes of the
+    melody) adds a bonus to keys with that root.
+    """
+    bonus = 0.15 * sum(pitch_classes)
+    tonics = list(tonics)
+    scores = [(score + bonus * tonics.count(root), root, mode)
+              for score, root, mode in key_scores(pitch_classes)]
+    return sorted(scores, key=lambda s: s[0], reverse=True)
+
+
+def best_key(pitch_classes, tonics=()):
+    """Return the Key whose profile best matches a 12-element pitch class
+    histogram (see rank_keys).
+    """
+    score, root, mode = rank_keys(pitch_classes, tonics)[0]
+    return Key(root=chromatic_notes[root], mode=mode)
+
+
 # sharps/flats in ionian keys
 key_sig = {'C#': 7, 'F#': 6, 'B': 5, 'E': 4, 'A': 3, 'D': 2, 'G': 1, 'C': 0,
            'F': -1, 'Bb': -2, 'Eb': -3, 'Ab': -4, 'Db': -5, 'Gb': -6, 'Cb': -7}
@@ -174,7 +229,10 @@ class Key(object):
     def accidentals(self):
         """A dictionary of accidentals in the key signature.
         """
-        return {p:a for p,a in self.key_signature}
+        # cached; this is looked up for every note
+        if getattr(self, '_accidentals', None) is None:
+            self._accidentals = {p:a for p,a in self.key_signature}
+        return self._accidentals
 
     @property
     def relative_ionian(self):
@@ -206,7 +264,12 @@ class Pitch(object):
         if isinstance(value, Note):
             self._note = value
 
-            if len(value.note) == 1:
+            acc = value.accidental or value.implied_accidental
+            if acc is not None:
+                # explicit accidental, or one carried from earlier in the bar
+                self._name = value.note.upper() + abc_accidentals[acc]
+                self._value = self.pitch_value(self._name)
+            elif len(value.note) == 1:
                 acc = value.key.accidentals.get(value.note[0].upper(), '')
                 self._name = value.note.upper() + acc
                 self._value = self.pitch_value(self._name)
@@ -303,6 +366,37 @@ class TimeSignature(object):
     def __repr__(self):
         return "<TimeSignature %d/%d>" % tuple(self._meter)
 
+    @property
+    def unit_beats(self):
+        """Length of the unit note in quarter notes.
+        """
+        return 4 * self._unit_len[0] / self._unit_len[1]
+
+    @property
+    def measure_units(self):
+        """Length of one measure in unit notes.
+        """
+        return (self._meter[0] / self._meter[1]) / (self._unit_len[0] / self._unit_len[1])
+
+    @property
+    def compound(self):
+        return self._meter[0] % 3 == 0 and self._meter[0] > 3
+
+    @property
+    def qpm(self):
+        """Tempo in quarter notes per minute, or None if no tempo is given.
+        """
+        if self._tempo is None:
+            return None
+        m = re.search(r'(\d+)/(\d+)\s*=\s*(\d+)', self._tempo)
+        if m is not None:
+            n, d, bpm = [int(x) for x in m.groups()]
+            return bpm * 4 * n / d
+        m = re.search(r'\d+', self._tempo)
+        if m is None:
+            return None
+        return int(m.group())
+
 
 # Decoration symbols from
 # http://abcnotation.com/wiki/abc:standard:v2.1#decorations
@@ -362,6 +456,51 @@ symbols = """
 
 
 
+# MIDI velocities for dynamics decorations
+dynamic_velocities = {'!pppp!': 16, '!ppp!': 24, '!pp!': 36, '!p!': 48, '!mp!': 64,
+                      '!mf!': 80, '!f!': 96, '!ff!': 112, '!fff!': 120, '!ffff!': 127}
+
+# decorations that accent the following note
+accent_decorations = ['L', '!>!', '!accent!', '!emphasis!']
+
+# default number of notes q in the time of p for tuplets (p
+# (5, (7 and (9 depend on whether the meter is compound
+tuplet_defaults = {2: 3, 3: 2, 4: 3, 6: 2, 8: 3}
+
+
+# A single sounding note produced by Tune.events(). Onset and duration are
+# measured in quarter notes; pitch is a MIDI note number.
+NoteEvent = collections.namedtuple('NoteEvent', ['onset', 'duration', 'pitch', 'velocity'])
+
+
+# A note of the melody line produced by Tune.melody. Pitch is the absolute
+# chromatic value (Pitch.abs_value), duration is in quarter notes, bar is the
+# number of bar lines preceding the note in its voice and index is its
+# position in Tune.tokens (or Voice.tokens, for a Voice's melody).
+MelodyNote = collections.namedtuple('MelodyNote', ['pitch', 'duration', 'bar', 'index'])
+
+# A passage in one key found by TokenStream.key_regions(), covering bars
+# start to stop-1 (bar numbers as in MelodyNote.bar)
+KeyRegion = collections.namedtuple('KeyRegion', ['start', 'stop', 'key'])
+
+
+class ParseError(Exception):
+    """Raised when part of a tune body cannot be tokenized.
+    """
+    def __init__(self, text, line, char, url=None):
+        Exception.__init__(self, "Unable to parse: %s\n%s" % (text, url))
+        self.text = text  # remainder of the line that could not be parsed
+        self.line = line
+        self.char = char
+        self.url = url
+
+    @property
+    def construct(self):
+        """The character that could not be parsed, used to categorize errors.
+        """
+        return self.text[:1]
+
+
 class Token(object):
     def __init__(self, line, char, text):
         self._line = line
@@ -372,33 +511,43 @@ class Token(object):
         return "<%s \"%s\">" % (self.__class__.__name__, self._text)
 
 
-class Note(Token):
-    def __init__(self, key, time, note, accidental, octave, num, denom, **kwds):
-        Token.__init__(self, **kwds)
-        self.key = key
-        self.time_sig = time
-        self.note = note
-        self.accidental = accidental
-        self.octave = octave
-        self._length = (num, denom)
+class Timed(object):
+    """Mixin for tokens with a written length that broken rhythm can alter.
 
-    @property
-    def pitch(self):
-        """Chromatic note value taking into account key signature and transpositions.
-        """
-        return Pitch(self)
+    The length is stored in self._length as a (num, denom) pair of ints,
+    parsed once when the token is created. Tune.tokenize() sets the tuplet
+    ratio in effect, and then the exact length of the token in ticks and its
+    onset from the start of its voice (see Tune.resolution).
+
+    The duration property of subclasses is the written length in unit note
+    lengths, before tuplets are applied; timing analyses use ticks.
+    """
+    tuplet = (1, 1)  # (q, p) of the tuplet the token is part of; its length is scaled by q/p
+    ticks = 0
+    onset = 0
+
+    def set_length(self, num, denom):
+        self._length = (int(num) if num is not None else 1, int(denom) if denom is not None else 1)
 
     @property
     def length(self):
-        n,d = self._length
-        return (int(n) if n is not None else 1, int(d) if d is not None else 1)
+        return self._length
 
     @property
-    def duration(self):
-        return self.length[0] / self.length[1]
+    def whole_length(self):
+        """Exact length as a reduced (num, denom) fraction of a whole note,
+        with the unit note length and tuplet applied.
+        """
+        num, den = self.length
+        return _reduce(num * self.time_sig._unit_len[0] * self.tuplet[0],
+                       den * self.time_sig._unit_len[1] * self.tuplet[1])
 
     def dotify(self, dots, direction):
         """Apply dot(s) to the duration of this note.
+
+        With n dots (> or <), the lengthened note is multiplied by
+        (2**(n+1) - 1) / 2**n, i.e. 3/2, 7/4, ..., and the shortened note by
+        1 / 2**n, so that the pair keeps its total length.
         """
         assert direction in ('left', 'right')
         longer = direction == 'left'
@@ -407,17 +556,75 @@ class Note(Token):
         n_dots = len(dots)
         num, den = self.length
         if longer:
-            num = num * 2 + 1
-            den = den * 2
-            self._length = (num, den)
-        else:
-            den = den * 2
-            self._length = (num, den)
+            num = num * (2 ** (n_dots + 1) - 1)
+        self._length = _reduce(num, den * 2 ** n_dots)
+
+
+def _reduce(num, den):
+    g = math.gcd(num, den) or 1
+    return (num // g, den // g)
+
+
+def _lcm(a, b):
+    return a * b // math.gcd(a, b)
+
+
+class Note(Timed, Token):
+    tied = False  # True for a chord note followed by a tie inside the chord, as in [A-c]
+
+    def __init__(self, key, time, note, accidental, octave, num, denom, implied_accidental=None, **kwds):
+        Token.__init__(self, **kwds)
+        self.key = key
+        self.time_sig = time
+        self.note = note
+        self.accidental = accidental
+        self.implied_accidental = implied_accidental  # accidental carried from earlier in the bar
+        self.octave = octave
+        self.set_length(num, denom)
+        self._pitch = None
+
+    @property
+    def pitch(self):
+        """Chromatic note value taking into account key signature and transpositions.
+        """
+        if self._pitch is None:
+            self._pitch = Pitch(self)
+        return self._pitch
+
+    @property
+    def duration(self):
+        return self.length[0] / self.length[1]
 
 
 
 class Beam(Token):
-    pass
+    """  |  ||  |]  |:  :|  ::  |1  :|2  [2  """
+    @property
+    def repeat_start(self):
+        return self._text.rstrip('0123456789-,').endswith(':')
+
+    @property
+    def repeat_end(self):
+        return self._text.lstrip(']').startswith(':')
+
+    @property
+    def ending(self):
+        """Number of the first/second ending started by this bar, or None.
+        """
+        m = re.search(r'\d', self._text)
+        return None if m is None else int(m.group())
+
+    @property
+    def is_bar(self):
+        """False for bare ending markers like  [2  that do not start a bar.
+        """
+        return self._text.strip('[]0123456789-,') != ''
+
+    @property
+    def section_end(self):
+        """True for thick/double bars:  ||  |]  [|
+        """
+        return '||' in self._text or '|]' in self._text or '[|' in self._text
 
 class Space(Token):
     pass
@@ -438,13 +645,56 @@ class Continuation(Token):
     pass
 
 class GracenoteBrace(Token):
-    """  {  {/  or }  """
+    """  {  {/  or }  outside of a grace group  """
     pass
 
 class ChordBracket(Token):
-    """  [  or  ]  """
+    """  [  or  ]  outside of a chord  """
     pass
 
+class Chord(Timed, Token):
+    """  [CEG]  [CEG]2  : notes that sound together.
+
+    The chord lasts as long as its first note, multiplied by its own length.
+    Other tokens written inside the brackets, such as ties and decorations,
+    are kept in self.marks.
+    """
+    def __init__(self, num=None, denom=None, **kwds):
+        Token.__init__(self, **kwds)
+        self.notes = []
+        self.marks = []
+        self.set_length(num, denom)
+
+    @property
+    def time_sig(self):
+        return self.notes[0].time_sig if len(self.notes) > 0 else None
+
+    @property
+    def duration(self):
+        if len(self.notes) == 0:
+            return 0
+        return self.notes[0].duration * self.length[0] / self.length[1]
+
+    @property
+    def whole_length(self):
+        if len(self.notes) == 0:
+            return (0, 1)
+        num, den = Timed.whole_length.fget(self)
+        first = self.notes[0].length
+        return _reduce(num * first[0], den * first[1])
+
+class GraceGroup(Token):
+    """  {gf}  {/g}  : grace notes, which take no time.
+    """
+    def __init__(self, acciaccatura=False, **kwds):
+        Token.__init__(self, **kwds)
+        self.notes = []
+        self.acciaccatura = acciaccatura
+
+    @property
+    def duration(self):
+        return 0
+
 class ChordSymbol(Token):
     """   "Amaj"   """
     pass
@@ -459,9 +709,17 @@ class Decoration(Token):
 
 class Tuplet(Token):
     """  (5   """
-    def __init__(self, num, **kwds):
+    def __init__(self, num, time=None, **kwds):
         Token.__init__(self, **kwds)
         self.num = num
+        self.time_sig = time
+
+    @property
+    def ratio(self):
+        """(q, p): the next p notes are played in the time of q.
+        """
+        p = int(self.num)
+        return (tuplet_defaults.get(p, 3 if self.time_sig.compound else 2), p)
 
 class BodyField(Token):
     pass
@@ -469,12 +727,26 @@ class BodyField(Token):
 class InlineField(Token):
     pass
 
-class Rest(Token):
-    def __init__(self, symbol, num, denom, **kwds):
+class Rest(Timed, Token):
+    def __init__(self, symbol, num, denom, time=None, **kwds):
         # char==X or Z means length is in measures
         Token.__init__(self, **kwds)
         self.symbol = symbol
-        self.length = (num, denom)
+        self.time_sig = time
+        self.set_length(num, denom)
+
+    @property
+    def duration(self):
+        dur = self.length[0] / self.length[1]
+        if self.symbol in 'XZ':
+            dur *= self.time_sig.measure_units
+        return dur
+
+    @property
+    def whole_length(self):
+        if self.symbol in 'XZ':
+            return _reduce(self.length[0] * self.time_sig._meter[0], self.length[1] * self.time_sig._meter[1])
+        return Timed.whole_length.fget(self)
 
 
 class InfoContext(object):
@@ -484,17 +756,453 @@ class InfoContext(object):
         self._fields = fields
 
     def __getattr__(self, field):
+        if field.startswith('_'):
+            # private and special names (looked up by pickle and copy before
+            # _fields exists) are not info fields
+            raise AttributeError(field)
         return self._fields.get(field, None)
 
     def copy(self, fields):
         """Return a copy with some fields updated
         """
-        f2 = InfoContext(self._fields)
+        f2 = InfoContext(dict(self._fields))
         f2._fields.update(fields)
         return f2
 
 
-class Tune(object):
+class TokenStream(object):
+    """Analyses shared by a whole Tune and by each of its Voices.
+
+    Subclasses provide a list of tokens in self.tokens.
+    """
+    @property
+    def notes(self):
+        """All sounding notes, including the notes of chords but not grace
+        notes.
+        """
+        notes = []
+        for token in self.tokens:
+            if isinstance(token, Note):
+                notes.append(token)
+            elif isinstance(token, Chord):
+                notes.extend(token.notes)
+        return notes
+
+    @property
+    def grace_notes(self):
+        return [n for t in self.tokens if isinstance(t, GraceGroup) for n in t.notes]
+
+    @property
+    def chords(self):
+        return [t for t in self.tokens if isinstance(t, Chord)]
+
+    def timed_notes(self):
+        """Generate (note, duration) for every sounding note, where duration
+        (in unit note lengths, with tuplets applied) is that of the note or of
+        its chord.
+        """
+        for token in self.tokens:
+            if isinstance(token, Note):
+                notes = [token]
+            elif isinstance(token, Chord):
+                notes = token.notes
+            else:
+                continue
+            for note in notes:
+                un, ud = note.time_sig._unit_len
+                yield note, token.ticks * ud / (un * self.resolution)
+
+    @property
+    def melody(self):
+        """List of MelodyNotes for the melody line, as written (repeats are
+        not unrolled).
+
+        Grace notes are skipped, chords are reduced to their highest note and
+        tuplets are applied. The list is computed once and cached.
+        """
+        if getattr(self, '_melody', None) is not None:
+            return self._melody
+        melody = []
+        bar = 0
+        beats = 4 / self.resolution
+        for i, token in enumerate(self.tokens):
+            if isinstance(token, Note):
+                melody.append(MelodyNote(token.pitch.abs_value, token.ticks * beats, bar, i))
+            elif isinstance(token, Chord) and len(token.notes) > 0:
+                pitch = max(n.pitch.abs_value for n in token.notes)
+                melody.append(MelodyNote(pitch, token.ticks * beats, bar, i))
+            elif isinstance(token, Beam) and token.is_bar:
+                bar += 1
+        self._melody = melody
+        return melody
+
+    @property
+    def bar_index(self):
+        """List of the positions in self.tokens at which each bar starts.
+        """
+        if getattr(self, '_bar_index', None) is not None:
+            return self._bar_index
+        bars = [0]
+        for i, token in enumerate(self.tokens):
+            if isinstance(token, Beam) and token.is_bar:
+                bars.append(i + 1)
+        self._bar_index = bars
+        return bars
+
+    def iter_performance(self):
+        """Generate tokens in the order they are played, with repeats and
+        first/second endings unrolled.
+
+        Repeats are resolved by jumping around in self.tokens, so the unrolled
+        tune is never built in memory.
+        """
+        tokens = self.tokens
+        start = 0  # index of the first token in the current repeated section
+        open_repeat = False  # True after |: until the matching :|
+        second_pass = False
+        i = 0
+        while i < len(tokens):
+            token = tokens[i]
+            if not isinstance(token, Beam):
+                yield token
+                i += 1
+                continue
+
+            if second_pass and token.ending == 1 and not token.repeat_end:
+                # skip the first ending; resume at the bar that closes it
+                i += 1
+                while i < len(tokens) and not (isinstance(tokens[i], Beam) and tokens[i].repeat_end):
+                    i += 1
+                if i == len(tokens):
+                    return
+                token = tokens[i]
+            elif token.repeat_end and not second_pass:
+                yield token
+                second_pass = True
+                i = start
+                continue
+
+            if token.repeat_end:
+                # a following :| with no |: repeats from here
+                second_pass = False
+                open_repeat = False
+                start = i + 1
+            yield token
+            if token.repeat_start:
+                start = i + 1
+                open_repeat = True
+            elif token.section_end and not open_repeat:
+                start = i + 1
+            i += 1
+
+    def events(self, velocity=80):
+        """Generate a NoteEvent for each note played in the tune.
+
+        Events are generated lazily in order of onset. Repeats are unrolled,
+        tied notes are merged, and tuplets and broken rhythms are applied.
+        The notes of a chord start together and last as long as the chord.
+        Grace notes take no time and are skipped. Dynamics decorations set the
+        base *velocity*; accents raise it for the following note.
+
+        Timing is computed in integer ticks and only converted to quarter
+        notes as events are yielded, so onsets do not drift in long tunes.
+        """
+        ready = []  # finished events waiting to be yielded in onset order
+        held = {}  # pitch: [onset, duration, pitch, velocity] of the last notes played, in ticks
+        tied = ()  # pitches the next notes extend
+        t = 0
+        beats = 4 / self.resolution  # quarter notes per tick
+        accent = False
+
+        def play(group, onset, tied):
+            # start new events for the notes in *group*, extending held notes
+            # if they are tied; retire everything else
+            previous = held.copy()
+            held.clear()
+            for pitch, dur, vel in group:
+                ev = previous.pop(pitch, None) if pitch in tied else None
+                if ev is None:
+                    ev = [onset, dur, pitch, vel]
+                else:
+                    ev[1] = onset + dur - ev[0]
+                held[pitch] = ev
+            for ev in previous.values():
+                heapq.heappush(ready, tuple(ev))
+
+        def flush():
+            # yield retired events that cannot be preceded by a held note
+            earliest = min(ev[0] for ev in held.values()) if held else None
+            while ready and (earliest is None or ready[0][0] <= earliest):
+                onset, dur, pitch, vel = heapq.heappop(ready)
+                yield NoteEvent(onset * beats, dur * beats, pitch, vel)
+
+        for token in self.iter_performance():
+            for mark in (token.marks if isinstance(token, Chord) else [token]):
+                if isinstance(mark, Decoration):
+                    if mark._text in dynamic_velocities:
+                        velocity = dynamic_velocities[mark._text]
+                    elif mark._text in accent_decorations:
+                        accent = True
+            if isinstance(token, Tie):
+                tied = set(held)
+            elif isinstance(token, (Note, Chord, Rest)):
+                if isinstance(token, Chord) and len(token.notes) == 0:
+                    continue
+                dur = token.ticks
+                vel = min(127, velocity + 20) if accent else velocity
+                if isinstance(token, Note):
+                    notes = [token]
+                elif isinstance(token, Chord):
+                    notes = token.notes
+                else:
+                    notes = []
+                if len(notes) > 0:
+                    accent = False
+                play([(60 + n.pitch.abs_value, dur, vel) for n in notes], t, tied)
+                tied = set(60 + n.pitch.abs_value for n in notes if n.tied)
+                t += dur
+                for ev in flush():
+                    yield ev
+
+        play([], t, ())
+        for ev in flush():
+            yield ev
+
+    def write_midi(self, fh, bpm=None, velocity=80):
+        """Write the tune to *fh* as a Standard MIDI File.
+
+        If *bpm* is not given, the tempo is read from the Q: field, or
+        defaults to 120 quarter notes per minute.
+        """
+        if bpm is None:
+            notes = self.notes
+            if len(notes) > 0:
+                bpm = notes[0].time_sig.qpm
+        write_midi(self.events(velocity=velocity), fh, bpm=bpm or 120)
+
+    def canonical(self):
+        """Return the musical content of the stream as a list of normalized
+        symbols, so that settings differing only in layout compare equal.
+
+        Pitches are resolved through the key and bar accidentals, and
+        durations are expressed as exact fractions of a whole note with
+        tuplets applied, so L: scaling and redundant accidentals do not
+        matter. Notes are written "pitch:duration", chords "[p,p]:duration"
+        (with "p-" for notes tied inside the chord), grace groups "{p,p}" and
+        rests "z:duration"; ties, bar lines, repeats and endings are kept as
+        "-", "|", "|:", ":|" and "[n". Spaces, line breaks, fields,
+        decorations, slurs, chord symbols, annotations and plain bar lines
+        before the first note or rest are dropped.
+        """
+        from fractions import Fraction
+        symbols = []
+        started = False  # True once a note or rest has been seen
+        for token in self.tokens:
+            if isinstance(token, (Note, Chord, Rest)):
+                started = True
+            if isinstance(token, GraceGroup):
+                symbols.append('{%s}' % ','.join(str(n.pitch.abs_value) for n in token.notes))
+            elif isinstance(token, Note):
+                symbols.append('%d:%s' % (token.pitch.abs_value, Fraction(token.ticks, self.resolution)))
+            elif isinstance(token, Chord) and len(token.notes) > 0:
+                pitches = sorted((n.pitch.abs_value, '-' if n.tied else '') for n in token.notes)
+                symbols.append('[%s]:%s' % (','.join('%d%s' % p for p in pitches), Fraction(token.ticks, self.resolution)))
+            elif isinstance(token, Rest):
+                symbols.append('z:%s' % Fraction(token.ticks, self.resolution))
+            elif isinstance(token, Tie):
+                symbols.append('-')
+            elif isinstance(token, Beam):
+                if token.repeat_end:
+                    symbols.append(':|')
+                if token.repeat_start:
+                    symbols.append('|:')
+                if token.is_bar and not (token.repeat_end or token.repeat_start) and started:
+                    symbols.append('|')
+                if token.ending is not None:
+                    symbols.append('[%d' % token.ending)
+        return symbols
+
+    @property
+    def content_hash(self):
+        """SHA-1 hex digest of the canonical() form.
+
+        Tunes with equal hashes are musically identical, so the hash can be
+        used to group duplicate settings or as a cache key for analyses.
+        """
+        if getattr(self, '_content_hash', None) is None:
+            self._content_hash = hashlib.sha1(' '.join(self.canonical()).encode('utf8')).hexdigest()
+        return self._content_hash
+
+    def pitchogram(self):
+        """Return a dict of the total duration (in unit note lengths) of each
+        chromatic pitch.
+        """
+        hist = {}
+        for note, duration in self.timed_notes():
+            v = note.pitch.abs_value
+            hist[v] = hist.get(v, 0) + duration
+        return hist
+
+    def pitch_classes(self):
+        """Return a list of the total duration (in quarter notes) of each of
+        the 12 pitch classes, starting at C.
+        """
+        hist = [0] * 12
+        for note in self.notes:
+            hist[note.pitch.abs_value % 12] += note.ticks
+        return [h * 4 / self.resolution for h in hist]
+
+    def detect_key(self):
+        """Return the Key that best fits the pitches used and the first and
+        last notes of the melody.
+        """
+        melody = self.melody
+        tonics = [melody[0].pitch % 12, melody[-1].pitch % 12] if len(melody) > 0 else []
+        return best_key(self.pitch_classes(), tonics)
+
+    def _scan_bars(self):
+        # One pass over the tokens collecting, per bar: cumulative pitch class
+        # durations in ticks, the first and last sounding pitch class, the
+        # bars at which parts start (after repeat signs and double bars), and
+        # the length of the bar and of a full measure in ticks. Then the
+        # first bar with notes at or after each bar, and the last before it.
+        if getattr(self, '_bar_scan', None) is not None:
+            return self._bar_scan
+        hists = [[0] * 12]
+        first, last = [None], [None]
+        parts = [0]
+        lengths = [[0, None]]
+        for token in self.tokens:
+            if isinstance(token, Beam) and token.is_bar:
+                hists.append([0] * 12)
+                first.append(None)
+                last.append(None)
+                lengths.append([0, None])
+                if token.repeat_start or token.repeat_end or token.section_end:
+                    parts.append(len(hists) - 1)
+            elif isinstance(token, (Note, Rest)) or (isinstance(token, Chord) and len(token.notes) > 0):
+                meter = token.time_sig._meter
+                lengths[-1][0] += token.ticks
+                lengths[-1][1] = self.resolution * meter[0] // meter[1]
+                if isinstance(token, Rest):
+                    continue
+                notes = [token] if isinstance(token, Note) else token.notes
+                for note in notes:
+                    hists[-1][note.pitch.abs_value % 12] += token.ticks
+                if first[-1] is None:
+                    first[-1] = notes[0].pitch.abs_value % 12
+                last[-1] = notes[0].pitch.abs_value % 12
+
+        # sums[b] is the histogram of bars 0..b-1
+        sums = [[0] * 12]
+        for hist in hists:
+            sums.append([a + b for a, b in zip(sums[-1], hist)])
+        # following[b] is the first bar >= b with notes, preceding[b] the
+        # last bar < b with notes
+        n = len(first)
+        following, preceding = [None] * (n + 1), [None] * (n + 1)
+        for bar in range(n - 1, -1, -1):
+            following[bar] = bar if first[bar] is not None else following[bar + 1]
+        for bar in range(n):
+            preceding[bar + 1] = bar if last[bar] is not None else preceding[bar]
+        self._bar_scan = (sums, first, last, parts, lengths, following, preceding)
+        return self._bar_scan
+
+    @property
+    def n_bars(self):
+        return len(self._scan_bars()[1])
+
+    def irregular_bars(self):
+        """Return (bar, ticks, measure ticks) for each bar whose length
+        differs from a full measure of the meter in effect, such as pickup
+        bars and bars with too many or too few notes. Bars without notes or
+        rests are ignored.
+        """
+        lengths = self._scan_bars()[4]
+        return [(bar, ticks, measure) for bar, (ticks, measure) in enumerate(lengths)
+                if measure is not None and ticks != measure]
+
+    def window_scores(self, start, stop):
+        """Return (scores, total) for bars start to stop-1, where scores is
+        the rank_keys() list for the window and total its duration in
+        quarter notes.
+
+        The pitch class histogram of the window and its first and last notes
+        are read from tables built once per stream, so each call costs the
+        same regardless of the window length.
+        """
+        sums, first, last, parts, lengths, following, preceding = self._scan_bars()
+        hist = [(b - a) * 4 / self.resolution for a, b in zip(sums[start], sums[stop])]
+        # first and last notes of the window hint at its tonic
+        tonics = []
+        bar = following[start]
+        if bar is not None and bar < stop:
+            tonics.append(first[bar])
+        bar = preceding[stop]
+        if bar is not None and bar >= start:
+            tonics.append(last[bar])
+        return rank_keys(hist, tonics), sum(hist)
+
+    def window_key(self, start, stop):
+        """Return the Key that best fits bars start to stop-1.
+        """
+        score, root, mode = self.window_scores(start, stop)[0][0]
+        return Key(root=chromatic_notes[root], mode=mode)
+
+    def key_windows(self, size=4):
+        """Return (start bar, Key) for every window of *size* bars.
+        """
+        n = self.n_bars
+        return [(b, self.window_key(b, min(b + size, n))) for b in range(max(n - size, 0) + 1)]
+
+    def key_regions(self, margin=0.4):
+        """Divide the stream into KeyRegions, such as an A part in D major
+        followed by a B part in E dorian.
+
+        Each part (delimited by repeat signs and double bars) is scored
+        separately. A part stays in the key of the previous region unless the
+        best key beats it by more than *margin* times the part's duration, so
+        ambiguous parts do not start new regions. Empty parts are joined to
+        their neighbours.
+        """
+        parts = self._scan_bars()[3]
+        n = self.n_bars
+        regions = []
+        start = 0
+        for stop in sorted(set(parts[1:] + [n])):
+            scores, total = self.window_scores(start, stop)
+            if total == 0:
+                if stop == n and len(regions) > 0:
+                    regions[-1] = regions[-1]._replace(stop=stop)
+                continue
+            best = scores[0]
+            if len(regions) > 0:
+                current = regions[-1].key
+                root, mode = current.root.value % 12, current.mode
+                score = [s for s in scores if s[1:] == (root, mode)][0][0]
+                if score >= best[0] - margin * total:
+                    regions[-1] = regions[-1]._replace(stop=stop)
+                    start = stop
+                    continue
+            regions.append(KeyRegion(start, stop, Key(root=chromatic_notes[best[1]], mode=best[2])))
+            start = stop
+        return regions
+
+
+class Voice(TokenStream):
+    """The tokens of a single voice (V: field) of a tune, with the key and
+    time signature in effect at the end of the voice.
+    """
+    def __init__(self, id):
+        self.id = id
+        self.tokens = []
+        self.context = None
+
+    def __repr__(self):
+        return "<Voice %s>" % self.id
+
+
+class Tune(TokenStream):
     """Initialize with either an ABC string or a json-parsed dict read from
     the TheSession API.
     """
@@ -510,13 +1218,9 @@ class Tune(object):
     def url(self):
         try:
             return "http://thesession.org/tunes/%d#setting%d" % (self.header['reference number'], self.header['setting'])
-        except KeyError:
+        except (KeyError, TypeError):
             return None
 
-    @property
-    def notes(self):
-        return [t for t in self.tokens if isinstance(t, Note)]
-
     def parse_abc(self, abc):
         self.abc = abc
         header = []
@@ -541,6 +1245,7 @@ class Tune(object):
         self.parse_tune(tune)
 
     def parse_json(self, json):
+        self.json = json
         self.header = {
             "reference number": json['tune'],
             "setting": json['setting'],
@@ -549,6 +1254,8 @@ class Tune(object):
             "unit note length": "1/" + json['meter'].split('/')[1],
             "key": json['mode'],
         }
+        if 'type' in json:
+            self.header['rhythm'] = json['type']
         self.parse_tune(json['abc'].split('\r\n'))
 
     def parse_header(self, header):
@@ -556,6 +1263,10 @@ class Tune(object):
         for line in header:
             key = line[0]
             data = line[2:].strip()
+            if key == 'V' and info_keys[key].name in h:
+                # several voices may be declared; body material before the
+                # first V: field belongs to the first one
+                continue
             h[info_keys[key].name] = data
         self.header = h
         self.reference = h['reference number']
@@ -563,8 +1274,75 @@ class Tune(object):
         self.key = h['key']
 
     def parse_tune(self, tune):
+        self._melody = None
+        self._bar_index = None
+        self._content_hash = None
+        self._bar_scan = None
         self.tokens = self.tokenize(tune, self.header)
 
+    @property
+    def melody(self):
+        """Melody of the first voice (see TokenStream.melody), with indexes
+        into Tune.tokens.
+        """
+        if len(self.voices) > 1:
+            if self._melody is None:
+                voice = list(self.voices.values())[0]
+                position = dict((id(token), i) for i, token in enumerate(self.tokens))
+                self._melody = [note._replace(index=position[id(voice.tokens[note.index])])
+                                for note in voice.melody]
+            return self._melody
+        return TokenStream.melody.fget(self)
+
+    def events(self, velocity=80):
+        """Generate NoteEvents for every voice, merged in order of onset
+        (see TokenStream.events).
+        """
+        if len(self.voices) > 1:
+            return heapq.merge(*[v.events(velocity=velocity) for v in self.voices.values()])
+        return TokenStream.events(self, velocity=velocity)
+
+    def canonical(self):
+        """Canonical form of each voice in turn, separated by "V"
+        (see TokenStream.canonical).
+        """
+        if len(self.voices) > 1:
+            symbols = []
+            for voice in self.voices.values():
+                symbols.append('V')
+                symbols.extend(voice.canonical())
+            return symbols
+        return TokenStream.canonical(self)
+
+    def map_voices(self, func, executor=None):
+        """Call func(voice) for each voice and return an OrderedDict of the
+        results keyed by voice id.
+
+        If a concurrent.futures *executor* is given, voices are analyzed in
+        parallel with executor.map. Use a ProcessPoolExecutor for CPU-bound
+        analyses; *func* must then be picklable.
+        """
+        voices = list(self.voices.values())
+        mapper = map if executor is None else executor.map
+        return collections.OrderedDict(zip([v.id for v in voices], mapper(func, voices)))
+
+    @staticmethod
+    def update_context(context, field, value):
+        """Return a copy of an InfoContext updated by a K:, L: or M: field.
+
+        Values that cannot be parsed leave the context unchanged.
+        """
+        try:
+            if field == 'K':
+                return context.copy({'key': Key(value)})
+            elif field == 'M':
+                return context.copy({'meter': value, 'time_sig': TimeSignature(value, context.unit, context.tempo)})
+            elif field == 'L':
+                return context.copy({'unit': value, 'time_sig': TimeSignature(context.meter, value, context.tempo)})
+        except (ValueError, TypeError):
+            pass
+        return context
+
     def tokenize(self, tune, header):
         # get initial key signature from header
         key = Key(self.header['key'])
@@ -580,15 +1358,60 @@ class Tune(object):
                 unit = "1/8"
         tempo = self.header.get('tempo', None)
         time_sig = TimeSignature(meter, unit, tempo)
+        header_context = InfoContext({'key': key, 'meter': meter, 'unit': unit,
+                                      'tempo': tempo, 'time_sig': time_sig})
 
+        # Each voice has its own token stream and key/meter context. Tokens
+        # before the first V: field belong to the voice named in the header.
+        voice_id = self.header.get('voice', '1').split(' ')[0]
+        voices = collections.OrderedDict()
+        context = header_context
+        accidentals = {}  # per voice; accidentals apply to later notes in the same bar
 
         tokens = []
+        chord = None  # Chord or GraceGroup being collected
+        grace = None
+        tuplets = {}  # per voice; ratio of the current tuplet and the number of notes left in it
+        time_sigs = [time_sig]
+        def add(token):
+            if chord is not None and token is not chord:
+                # ties and decorations inside [...] belong to the chord
+                if isinstance(token, Tie) and len(chord.notes) > 0:
+                    chord.notes[-1].tied = True
+                chord.marks.append(token)
+                return
+            if voice_id not in voices:
+                voices[voice_id] = Voice(voice_id)
+            tokens.append(token)
+            voices[voice_id].tokens.append(token)
+
+        def timed(token):
+            # add a Note, Chord or Rest, placing it in the current tuplet
+            tuplet = tuplets.get(voice_id)
+            if tuplet is not None and tuplet[1] > 0:
+                token.tuplet = tuplet[0]
+                tuplet[1] -= 1
+            add(token)
+
+        def switch_voice(new_id):
+            # store the context of the current voice and restore the new one's
+            if voice_id in voices:
+                voices[voice_id].context = context
+            if new_id in voices:
+                return new_id, voices[new_id].context
+            return new_id, header_context
+
         for i,line in enumerate(tune):
-            print(line)
             line = line.rstrip()
 
             if len(line) > 2 and line[1] == ':' and (line[0] == '+' or line[0] in tune_body_fields):
-                tokens.append(BodyField(line=i, char=0, text=line))
+                value = line[2:].strip()
+                if line[0] == 'V' and value != '':
+                    voice_id, context = switch_voice(value.split()[0])
+                else:
+                    context = self.update_context(context, line[0], value)
+                    time_sigs.append(context.time_sig)
+                add(BodyField(line=i, char=0, text=line))
                 continue
 
             pending_dots = None
@@ -601,17 +1424,21 @@ class Tune(object):
                     fields = ''.join(inline_fields.keys())
                     m = re.match(r'\[[%s]:([^\]]+)\]' % fields, part)
                     if m is not None:
-                        if m.group()[1] == 'K':
-                            key = Key(m.group()[3:-1])
-
-                        tokens.append(InlineField(line=i, char=j, text=m.group()))
+                        field, value = m.group()[1], m.group()[3:-1].strip()
+                        if field == 'V' and value != '':
+                            voice_id, context = switch_voice(value.split()[0])
+                        else:
+                            context = self.update_context(context, field, value)
+                            time_sigs.append(context.time_sig)
+
+                        add(InlineField(line=i, char=j, text=m.group()))
                         j += m.end()
                         continue
 
                 # Space
                 m = re.match(r'(\s+)', part)
                 if m is not None:
-                    tokens.append(Space(line=i, char=j, text=m.group()))
+                    add(Space(line=i, char=j, text=m.group()))
                     j += m.end()
                     continue
 
@@ -625,40 +1452,74 @@ class Tune(object):
                         octave -= g['oct'].count(",")
                         octave += g['oct'].count("'")
 
-                    num = g.get('num', 1)
+                    num = g['num']
                     if g['den'] is not None:
                         denom = g['den']
                     elif g['slash'] is not None:
-                        denom = 2 * g['slash'].count('/')
+                        denom = 2 ** len(g['slash'])
                     else:
                         denom = 1
 
-                    tokens.append(Note(key=key, time=time_sig, note=g['note'], accidental=g['acc'],
-                        octave=octave, num=num, denom=denom, line=i, char=j, text=m.group()))
+                    bar_accidentals = accidentals.setdefault(voice_id, {})
+                    pitch_key = (g['note'].upper(), octave)
+                    if g['acc'] is not None:
+                        bar_accidentals[pitch_key] = g['acc']
+                    note = Note(key=context.key, time=context.time_sig, note=g['note'], accidental=g['acc'],
+                        octave=octave, num=num, denom=denom, implied_accidental=bar_accidentals.get(pitch_key),
+                        line=i, char=j, text=m.group())
+                    if grace is not None:
+                        grace.notes.append(note)
+                    elif chord is not None:
+                        chord.notes.append(note)
+                    else:
+                        timed(note)
+                        if pending_dots is not None:
+                            tokens[-1].dotify(pending_dots, 'right')
+                            pending_dots = None
+
+                    j += m.end()
+                    continue
 
+                # Chord  [CEG]2
+                if chord is None and part[0] == '[' and len(part) > 1 and part[1] not in '|]:0123456789':
+                    chord = Chord(line=i, char=j, text='[')
+                    j += 1
+                    continue
+                if chord is not None and part[0] == ']':
+                    m = re.match(r'\](?P<num>\d+)?(?P<slash>/+)?(?P<den>\d+)?', part)
+                    g = m.groupdict()
+                    chord.set_length(g['num'], g['den'] if g['den'] is not None or g['slash'] is None
+                                     else 2 ** len(g['slash']))
+                    chord._text = line[chord._char:j+m.end()]
+                    timed(chord)
+                    chord = None
                     if pending_dots is not None:
                         tokens[-1].dotify(pending_dots, 'right')
                         pending_dots = None
-
                     j += m.end()
                     continue
 
-                # Beam  |   :|   |:   ||   and Chord  [ABC]
+                # Beam  |   :|   |:   ||   [|   |1   :|2
                 m = re.match(r'([\[\]\|\:]+)([0-9\-,])?', part)
                 if m is not None:
-                    if m.group() in '[]':
-                        tokens.append(ChordBracket(line=i, char=j, text=m.group()))
+                    text = m.group()
+                    if m.group(2) is None and len(text) > 1 and text.endswith('['):
+                        # leave the [ of a chord following the bar line
+                        text = text[:-1]
+                    if text in '[]':
+                        add(ChordBracket(line=i, char=j, text=text))
                     else:
-                        tokens.append(Beam(line=i, char=j, text=m.group()))
-                    j += m.end()
+                        add(Beam(line=i, char=j, text=text))
+                        accidentals[voice_id] = {}
+                    j += len(text)
                     continue
 
                 # Broken rhythm
-                if len(tokens) > 0 and isinstance(tokens[-1], (Note, Rest)):
+                if len(tokens) > 0 and isinstance(tokens[-1], (Note, Rest, Chord)):
                     m = re.match('<+|>+', part)
                     if m is not None:
-                        tokens[-1].dotify(part, 'left')
-                        pending_dots = part
+                        tokens[-1].dotify(m.group(), 'left')
+                        pending_dots = m.group()
                         j += m.end()
                         continue
 
@@ -666,7 +1527,8 @@ class Tune(object):
                 m = re.match(r'([XZxz])(\d+)?(/(\d+)?)?', part)
                 if m is not None:
                     g = m.groups()
-                    tokens.append(Rest(g[0], num=g[1], denom=g[3], line=i, char=j, text=m.group()))
+                    denom = g[3] if g[3] is not None or g[2] is None else 2
+                    timed(Rest(g[0], num=g[1], denom=denom, time=context.time_sig, line=i, char=j, text=m.group()))
 
                     if pending_dots is not None:
                         tokens[-1].dotify(pending_dots, 'right')
@@ -678,75 +1540,691 @@ class Tune(object):
                 # Tuplets  (must parse before slur)
                 m = re.match(r'\(([2-9])', part)
                 if m is not None:
-                    tokens.append(Tuplet(num=m.groups()[0], line=i, char=j, text=m.group()))
+                    add(Tuplet(num=m.groups()[0], time=context.time_sig, line=i, char=j, text=m.group()))
+                    tuplets[voice_id] = [tokens[-1].ratio, int(m.groups()[0])]
                     j += m.end()
                     continue
 
                 # Slur
                 if part[0] in '()':
-                    tokens.append(Slur(line=i, char=j, text=part[0]))
+                    add(Slur(line=i, char=j, text=part[0]))
                     j += 1
                     continue
 
                 # Tie
                 if part[0] == '-':
-                    tokens.append(Tie(line=i, char=j, text=part[0]))
+                    add(Tie(line=i, char=j, text=part[0]))
                     j += 1
                     continue
 
-                # Embelishments
-                m = re.match(r'(\{\\?)|\}', part)
-                if m is not None:
-                    tokens.append(GracenoteBrace(line=i, char=j, text=m.group()))
+                # Grace notes  {gf}  {/g}
+                m = re.match(r'\{/?', part)
+                if m is not None and grace is None:
+                    grace = GraceGroup(acciaccatura=m.group() == '{/', line=i, char=j, text=m.group())
                     j += m.end()
                     continue
+                if part[0] == '}':
+                    if grace is None:
+                        add(GracenoteBrace(line=i, char=j, text='}'))
+                    else:
+                        grace._text = line[grace._char:j+1]
+                        add(grace)
+                        grace = None
+                    j += 1
+                    continue
 
                 # Decorations (single character)
                 if part[0] in '.~HLMOPSTuv':
-                    tokens.append(Decoration(line=i, char=j, text=part[0]))
+                    add(Decoration(line=i, char=j, text=part[0]))
                     j += 1
                     continue
 
                 # Decorations (!symbol!)
                 m = re.match(r'\!([^\! ]+)\!', part)
                 if m is not None:
-                    tokens.append(Decoration(line=i, char=j, text=m.group()))
+                    add(Decoration(line=i, char=j, text=m.group()))
                     j += m.end()
                     continue
 
                 # Continuation
-                if j == len(line) - 1 and j == '\\':
-                    tokens.append(Continuation(line=i, char=j, text='\\'))
+                if j == len(line) - 1 and part[0] == '\\':
+                    add(Continuation(line=i, char=j, text='\\'))
                     j += 1
                     continue
 
                 # Annotation
                 m = re.match(r'"[\^\_\<\>\@][^"]+"', part)
                 if m is not None:
-                    tokens.append(Annotation(line=i, char=j, text=m.group()))
+                    add(Annotation(line=i, char=j, text=m.group()))
                     j += m.end()
                     continue
 
                 # Chord symbol
                 m = re.match(r'"[\w#/]+"', part)
                 if m is not None:
-                    tokens.append(ChordSymbol(line=i, char=j, text=m.group()))
+                    add(ChordSymbol(line=i, char=j, text=m.group()))
                     j += m.end()
                     continue
 
-                raise Exception("Unable to parse: %s\n%s" % (part, self.url))
+                raise ParseError(part, line=i, char=j, url=self.url)
 
-            if not isinstance(tokens[-1], Continuation):
-                tokens.append(Newline(line=i, char=j, text='\n'))
+            if len(tokens) == 0 or not isinstance(tokens[-1], Continuation):
+                add(Newline(line=i, char=j, text='\n'))
 
+        # keep the notes of a chord or grace group left open at the end
+        for group in (chord, grace):
+            if group is not None:
+                add(group)
+
+        if voice_id in voices:
+            voices[voice_id].context = context
+        self.voices = voices
+        self.resolution = self.assign_ticks(voices.values(), time_sigs)
         return tokens
 
-    def pitchogram(tune):
-        hist = {}
-        for note in tune.notes:
-            v = note.pitch.abs_value
-            hist[v] = hist.get(v, 0) + note.duration
-        return hist
+    @staticmethod
+    def assign_ticks(voices, time_sigs=()):
+        """Set the exact tick length and onset of every timed token in
+        *voices*, and return the resolution in ticks per whole note.
+
+        The resolution is the least common multiple of the denominators of
+        all note lengths (with unit lengths, tuplets and broken rhythms
+        applied) and of the meters and unit lengths in *time_sigs*, so every
+        note, rest, chord and measure is a whole number of ticks. Onsets count
+        from the start of each voice, as written (repeats are not unrolled);
+        chord members and grace notes share the onset of the token they belong
+        to.
+        """
+        resolution = 1
+        for ts in time_sigs:
+            resolution = _lcm(_lcm(resolution, ts._meter[1]), ts._unit_len[1])
+        lengths = {}
+        for voice in voices:
+            for token in voice.tokens:
+                if isinstance(token, Timed):
+                    lengths[token] = token.whole_length
+                    resolution = _lcm(resolution, lengths[token][1])
+
+        for voice in voices:
+            voice.resolution = resolution
+            t = 0
+            for token in voice.tokens:
+                if isinstance(token, Timed):
+                    num, den = lengths[token]
+                    token.onset = t
+                    token.ticks = num * (resolution // den)
+                    for note in getattr(token, 'notes', ()):
+                        note.onset, note.ticks = t, token.ticks
+                    t += token.ticks
+                elif isinstance(token, GraceGroup):
+                    for note in token.notes:
+                        note.onset = t
+        return resolution
+
+
+# A motif occurrence found by MotifIndex.search()
+MotifHit = collections.namedtuple('MotifHit', ['tune', 'setting', 'bar', 'token', 'mismatches'])
+
+
+def motif_symbols(melody, rhythm=False):
+    """Encode a sequence of MelodyNotes as interval symbols.
+
+    Each symbol describes the step from one note to the next: the interval in
+    semitones and, if *rhythm* is True, the duration ratio of the two notes
+    quantized to half-octaves (log2 steps of 0.5). All symbols are > 0 so that
+    0 can be used as a separator.
+    """
+    symbols = []
+    for a, b in zip(melody[:-1], melody[1:]):
+        interval = max(-127, min(127, b.pitch - a.pitch)) + 128
+        if not rhythm:
+            symbols.append(interval)
+            continue
+        ratio = int(round(2 * math.log(b.duration / a.duration, 2))) if a.duration > 0 and b.duration > 0 else 0
+        symbols.append((interval << 4) | (max(-7, min(7, ratio)) + 8))
+    return symbols
+
+
+def _suffix_array(text):
+    """Return the suffix array of a sequence of ints by prefix doubling.
+    """
+    n = len(text)
+    sa = list(range(n))
+    # start from dense ranks so that the sort keys below cannot collide
+    symbols = dict((c, r) for r, c in enumerate(sorted(set(text))))
+    rank = [symbols[c] for c in text]
+    k = 1
+    while n > 0:
+        # sort by (rank of first k symbols, rank of next k symbols)
+        key = [rank[i] * (n + 1) + (rank[i+k] + 1 if i + k < n else 0) for i in range(n)]
+        sa.sort(key=key.__getitem__)
+        r = 0
+        rank[sa[0]] = 0
+        for a, b in zip(sa[:-1], sa[1:]):
+            if key[b] != key[a]:
+                r += 1
+            rank[b] = r
+        if r == n - 1:
+            break
+        k *= 2
+    return sa
+
+
+class MotifIndex(object):
+    """Index of melodic motifs across a corpus of tunes.
+
+    The melody of each tune is encoded as interval symbols (see
+    motif_symbols), so motifs are found in any key. All tunes are
+    concatenated, separated by 0, and a suffix array over the result allows
+    exact motif queries by binary search. Queries allowing mismatches split
+    the motif into exactly matching seeds and verify each candidate.
+
+    Build with MotifIndex.build(tunes); the index can be saved to disk and
+    loaded again by memory map.
+    """
+    magic = b'PYABCMI1'
+
+    def __init__(self, text, sa, bars, tokens, starts, refs, settings, rhythm=False):
+        self.text = text  # concatenated symbols
+        self.sa = sa  # suffix array of text
+        self.bars = bars  # bar number of the note starting each symbol
+        self.tokens = tokens  # token index of the note starting each symbol
+        self.starts = starts  # offset in text of each tune
+        self.refs = refs  # reference number of each tune
+        self.settings = settings  # setting number of each tune, or -1
+        self.rhythm = rhythm
+
+    @classmethod
+    def build(cls, tunes, rhythm=False):
+        """Build an index from an iterable of Tunes.
+        """
+        from array import array
+        text, bars, tokens = array('i'), array('i'), array('i')
+        starts, refs, settings = array('i'), array('i'), array('i')
+        for tune in tunes:
+            melody = tune.melody
+            starts.append(len(text))
+            refs.append(int(tune.header.get('reference number', -1)))
+            settings.append(int(tune.header.get('setting', -1)))
+            text.extend(motif_symbols(melody, rhythm))
+            bars.extend([note.bar for note in melody[:-1]])
+            tokens.extend([note.index for note in melody[:-1]])
+            text.append(0)
+            bars.append(-1)
+            tokens.append(-1)
+        sa = array('i', _suffix_array(text))
+        return cls(text, sa, bars, tokens, starts, refs, settings, rhythm)
+
+    def save(self, filename):
+        """Write the index to *filename*.
+
+        The file holds a small header followed by the int32 arrays in native
+        byte order, so load() can map them without copying.
+        """
+        from array import array
+        with open(filename, 'wb') as fh:
+            fh.write(self.magic)
+            fh.write(struct.pack('<III', len(self.text), len(self.starts), int(self.rhythm)))
+            for arr in (self.text, self.sa, self.bars, self.tokens, self.starts, self.refs, self.settings):
+                fh.write(array('i', arr).tobytes())
+
+    @classmethod
+    def load(cls, filename):
+        """Load an index saved with save() by memory-mapping the file.
+        """
+        import mmap
+        with open(filename, 'rb') as fh:
+            mm = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        if mm[:8] != cls.magic:
+            raise ValueError("%s is not a motif index file" % filename)
+        n, n_tunes, rhythm = struct.unpack('<III', mm[8:20])
+        view = memoryview(mm)[20:].cast('i')
+        arrays = []
+        offset = 0
+        for size in (n, n, n, n, n_tunes, n_tunes, n_tunes):
+            arrays.append(view[offset:offset+size])
+            offset += size
+        index = cls(*arrays, rhythm=bool(rhythm))
+        index._mmap = mm
+        return index
+
+    def __len__(self):
+        return len(self.starts)
+
+    def encode(self, motif):
+        """Convert a motif to a list of symbols.
+
+        *motif* may be a string of ABC notes (such as "dBAF") or, for indexes
+        built without rhythm, a sequence of chromatic pitch values.
+        """
+        if isinstance(motif, str_type):
+            tune = Tune(abc="X:0\nT:motif\nM:4/4\nL:1/8\nK:C\n%s\n" % motif)
+            return motif_symbols(tune.melody, self.rhythm)
+        if self.rhythm:
+            raise ValueError("Motifs for a rhythm index must be given as ABC")
+        return motif_symbols([MelodyNote(p, 1, 0, 0) for p in motif])
+
+    def _range(self, query):
+        # range of suffix array entries whose suffixes start with query
+        m = len(query)
+        text, sa = self.text, self.sa
+        lo, hi = 0, len(sa)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if list(text[sa[mid]:sa[mid]+m]) < query:
+                lo = mid + 1
+            else:
+                hi = mid
+        start = lo
+        hi = len(sa)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if list(text[sa[mid]:sa[mid]+m]) <= query:
+                lo = mid + 1
+            else:
+                hi = mid
+        return start, lo
+
+    def find(self, query):
+        """Return the text offsets of every exact occurrence of a list of
+        symbols.
+        """
+        query = list(query)
+        start, stop = self._range(query)
+        return sorted(self.sa[start:stop])
+
+    def search(self, motif, mismatches=0):
+        """Find all occurrences of *motif* with at most *mismatches*
+        differing symbols.
+
+        Returns a list of MotifHits giving the tune reference and setting
+        number, and the bar and token index of the first note of each match.
+        """
+        import bisect
+        query = self.encode(motif)
+        m = len(query)
+        if m == 0:
+            raise ValueError("Motif must contain at least two notes")
+        if mismatches == 0:
+            candidates = {pos: 0 for pos in self.find(query)}
+        else:
+            # any match with k mismatches contains one of k+1 seeds exactly
+            n_seeds = min(mismatches + 1, m)
+            bounds = [m * i // n_seeds for i in range(n_seeds + 1)]
+            candidates = {}
+            for a, b in zip(bounds[:-1], bounds[1:]):
+                for pos in self.find(query[a:b]):
+                    start = pos - a
+                    if start < 0 or start in candidates or start + m > len(self.text):
+                        continue
+                    window = list(self.text[start:start+m])
+                    if 0 in window:
+                        continue
+                    diff = sum(x != y for x, y in zip(window, query))
+                    if diff <= mismatches:
+                        candidates[start] = diff
+
+        hits = []
+        for pos in sorted(candidates):
+            tune = bisect.bisect_right(self.starts, pos) - 1
+            hits.append(MotifHit(self.refs[tune], self.settings[tune], self.bars[pos], self.tokens[pos], candidates[pos]))
+        return hits
+
+
+def group_duplicates(tunes):
+    """Group tunes that are musically identical.
+
+    Returns an OrderedDict mapping each content_hash to the list of tunes
+    that share it, in order of first appearance.
+    """
+    groups = collections.OrderedDict()
+    for tune in tunes:
+        groups.setdefault(tune.content_hash, []).append(tune)
+    return groups
+
+
+def iter_chunks(iterable, size):
+    """Yield lists of up to *size* consecutive items from *iterable*.
+    """
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if len(chunk) > 0:
+        yield chunk
+
+
+class FeatureExtractor(object):
+    """Count melodic n-grams per tune as a sparse matrix for machine learning.
+
+    Features are n-grams of the intervals between successive melody notes, of
+    note durations, and of melodic contour (u/d/s for up, down, same), read
+    from Tune.melody. Feature names look like "i:2,-1" or "c:u,u,d".
+
+    Columns are assigned by a crc32 hash of the feature name, which is stable
+    across processes and runs. If a *vocabulary* dict mapping feature names to
+    columns is given instead, features not in it are ignored.
+    """
+    kinds = ('interval', 'rhythm', 'contour')
+
+    def __init__(self, ngrams=(1, 2, 3), kinds=None, n_features=2**20, vocabulary=None):
+        self.ngrams = tuple(ngrams)
+        self.kinds = tuple(kinds or FeatureExtractor.kinds)
+        self.vocabulary = vocabulary
+        self.n_features = n_features if vocabulary is None else len(vocabulary)
+
+    def features(self, melody):
+        """Generate the name of every feature occurrence in *melody*, a list
+        of MelodyNotes or (pitch, duration) pairs.
+        """
+        pitches = [note[0] for note in melody]
+        intervals = [b - a for a, b in zip(pitches[:-1], pitches[1:])]
+        sequences = []
+        if 'interval' in self.kinds:
+            sequences.append(('i', [str(x) for x in intervals]))
+        if 'rhythm' in self.kinds:
+            sequences.append(('r', ['%g' % note[1] for note in melody]))
+        if 'contour' in self.kinds:
+            sequences.append(('c', ['u' if x > 0 else ('d' if x < 0 else 's') for x in intervals]))
+        for prefix, seq in sequences:
+            for n in self.ngrams:
+                for i in range(len(seq) - n + 1):
+                    yield prefix + ':' + ','.join(seq[i:i+n])
+
+    def column(self, feature):
+        """Return the column for a feature name, or None if it is not in the
+        vocabulary.
+        """
+        if self.vocabulary is not None:
+            return self.vocabulary.get(feature)
+        return zlib.crc32(feature.encode('utf8')) % self.n_features
+
+    def fit_vocabulary(self, tunes, min_count=1):
+        """Build a vocabulary of every feature occurring in at least
+        *min_count* tunes, with columns in sorted feature order.
+        """
+        counts = {}
+        for tune in tunes:
+            for feature in set(self.features(tune.melody)):
+                counts[feature] = counts.get(feature, 0) + 1
+        names = sorted(f for f, c in counts.items() if c >= min_count)
+        self.vocabulary = {f: i for i, f in enumerate(names)}
+        self.n_features = len(names)
+        return self.vocabulary
+
+    def count_chunk(self, melodies):
+        """Count features for a list of melodies.
+
+        Returns (indices, data, lengths) arrays: the sorted columns and counts
+        of each row concatenated, and the number of entries in each row.
+        """
+        from array import array
+        indices, data, lengths = array('i'), array('d'), array('i')
+        for melody in melodies:
+            counts = {}
+            for feature in self.features(melody):
+                col = self.column(feature)
+                if col is not None:
+                    counts[col] = counts.get(col, 0) + 1
+            cols = sorted(counts)
+            indices.extend(cols)
+            data.extend([counts[c] for c in cols])
+            lengths.append(len(cols))
+        return indices, data, lengths
+
+    def transform(self, tunes, chunksize=1000, processes=None):
+        """Return a scipy.sparse.csr_matrix of feature counts with one row per
+        tune.
+
+        *tunes* may be any iterable; it is consumed in chunks of *chunksize*
+        tunes. If *processes* is given, chunks are counted in a
+        multiprocessing pool with at most two chunks per worker in flight, so
+        memory use stays bounded. Only the resolved (pitch, duration) pairs of
+        each melody are sent to the workers.
+        """
+        import numpy as np
+        import scipy.sparse
+        from array import array
+        chunks = ([[(note.pitch, note.duration) for note in tune.melody] for tune in chunk]
+                  for chunk in iter_chunks(tunes, chunksize))
+
+        indices, data, lengths = array('i'), array('d'), array('i')
+        def collect(result):
+            indices.extend(result[0])
+            data.extend(result[1])
+            lengths.extend(result[2])
+
+        if processes is None:
+            for chunk in chunks:
+                collect(self.count_chunk(chunk))
+        else:
+            import multiprocessing
+            pool = multiprocessing.Pool(processes)
+            try:
+                pending = collections.deque()
+                for chunk in chunks:
+                    pending.append(pool.apply_async(self.count_chunk, (chunk,)))
+                    if len(pending) >= 2 * processes:
+                        collect(pending.popleft().get())
+                while pending:
+                    collect(pending.popleft().get())
+            finally:
+                pool.close()
+                pool.join()
+
+        indptr = np.zeros(len(lengths) + 1, dtype=np.int64)
+        np.cumsum(np.frombuffer(lengths, dtype=np.int32), out=indptr[1:])
+        return scipy.sparse.csr_matrix(
+            (np.frombuffer(data, dtype=np.float64), np.frombuffer(indices, dtype=np.int32), indptr),
+            shape=(len(lengths), self.n_features))
+
+
+# normalize mode names so keys can be compared
+canonical_modes = {'ionian': 'major', 'aeolian': 'minor'}
+
+
+class ResultsStore(object):
+    """SQLite database of per-tune analysis results.
+
+    Each row holds the main header fields, the root (as a pitch class) and
+    mode of both the K: field and the detected key, note and bar counts, the
+    content hash, the duration of each pitch class (pc0..pc11) and the source
+    needed to rebuild the Tune. Rows are written in large batched transactions, and
+    indexes cover the key, meter, rhythm, reference and content hash columns.
+
+        store = ResultsStore('results.db')
+        store.add_tunes(Tune(json=t) for t in get_thesession_tunes())
+        for row in store.query(key='Edor', meter='12/8', rhythm='slide'):
+            print(row['title'])
+    """
+    columns = (['reference', 'setting', 'title', 'rhythm', 'meter', 'unit', 'key',
+                'key_root', 'key_mode', 'detected_root', 'detected_mode',
+                'n_notes', 'n_bars', 'n_voices', 'content_hash'] +
+               ['pc%d' % i for i in range(12)] + ['source'])
+
+    def __init__(self, filename):
+        import sqlite3
+        self.filename = filename
+        self.db = sqlite3.connect(filename)
+        self.db.row_factory = sqlite3.Row
+        self.db.execute("PRAGMA synchronous = NORMAL")
+        self.create_tables()
+
+    def create_tables(self):
+        with self.db:
+            self.db.execute("""
+                CREATE TABLE IF NOT EXISTS tunes (
+                    id INTEGER PRIMARY KEY,
+                    reference INTEGER, setting INTEGER, title TEXT, rhythm TEXT,
+                    meter TEXT, unit TEXT, key TEXT, key_root INTEGER, key_mode TEXT,
+                    detected_root INTEGER, detected_mode TEXT,
+                    n_notes INTEGER, n_bars INTEGER, n_voices INTEGER, content_hash TEXT,
+                    %s,
+                    source TEXT)""" % ', '.join('pc%d REAL' % i for i in range(12)))
+            for cols in ('key_root, key_mode', 'detected_root, detected_mode',
+                         'meter, rhythm', 'rhythm', 'reference, setting', 'content_hash'):
+                name = 'tunes_' + cols.replace(', ', '_')
+                self.db.execute("CREATE INDEX IF NOT EXISTS %s ON tunes (%s)" % (name, cols))
+
+    def close(self):
+        self.db.close()
+
+    def __len__(self):
+        return self.db.execute("SELECT COUNT(*) FROM tunes").fetchone()[0]
+
+    @staticmethod
+    def _key_values(key):
+        # (root pitch class, normalized mode) for a Key
+        return key.root.value % 12, canonical_modes.get(key.mode, key.mode)
+
+    def row(self, tune):
+        """Return the column values for *tune* in the order of self.columns.
+        """
+        import json
+        h = tune.header
+        key_root, key_mode = self._key_values(Key(h['key']))
+        detected_root, detected_mode = self._key_values(tune.detect_key())
+        if getattr(tune, 'json', None) is not None:
+            source = json.dumps({'json': tune.json})
+        else:
+            source = json.dumps({'abc': tune.abc})
+        setting = h.get('setting')
+        return ([int(h.get('reference number', -1)), None if setting is None else int(setting),
+                 h.get('tune title'), h.get('rhythm'), h.get('meter'), h.get('unit note length'),
+                 h['key'], key_root, key_mode, detected_root, detected_mode,
+                 len(tune.notes), len(tune.bar_index) - 1, len(tune.voices), tune.content_hash] +
+                tune.pitch_classes() + [source])
+
+    def add_tunes(self, tunes, batch_size=1000):
+        """Analyze and store every Tune in an iterable, committing once per
+        *batch_size* tunes. Returns the number of tunes added.
+        """
+        sql = "INSERT INTO tunes (%s) VALUES (%s)" % (
+            ', '.join(self.columns), ', '.join('?' * len(self.columns)))
+        n = 0
+        for batch in iter_chunks(tunes, batch_size):
+            rows = [self.row(tune) for tune in batch]
+            with self.db:
+                self.db.executemany(sql, rows)
+            n += len(rows)
+        return n
+
+    def query(self, key=None, detected_key=None, meter=None, rhythm=None, mode_differs=False,
+              reference=None, content_hash=None, limit=None):
+        """Return sqlite3.Rows for tunes matching all given criteria.
+
+        *key* and *detected_key* are key names such as "Edor" matched against
+        the K: field and the detected key. If *mode_differs* is True, only
+        tunes whose detected key differs from their K: field are returned.
+        """
+        where, args = [], []
+        for name, value in (('key', key), ('detected', detected_key)):
+            if value is not None:
+                root, mode = self._key_values(Key(value))
+                where.append("%s_root = ? AND %s_mode = ?" % (name, name))
+                args.extend([root, mode])
+        for name, value in (('meter', meter), ('rhythm', rhythm), ('reference', reference),
+                            ('content_hash', content_hash)):
+            if value is not None:
+                where.append("%s = ?" % name)
+                args.append(value)
+        if mode_differs:
+            where.append("(detected_root != key_root OR detected_mode != key_mode)")
+        sql = "SELECT * FROM tunes"
+        if len(where) > 0:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY id"
+        if limit is not None:
+            sql += " LIMIT %d" % limit
+        return self.db.execute(sql, args)
+
+    def tunes(self, **criteria):
+        """Generate Tunes for rows matching *criteria* (see query()), parsing
+        each one only when it is reached.
+        """
+        for row in self.query(**criteria):
+            yield self.load(row)
+
+    @staticmethod
+    def load(row):
+        """Rebuild the Tune stored in a row.
+        """
+        import json
+        source = json.loads(row['source'])
+        if 'json' in source:
+            return Tune(json=source['json'])
+        return Tune(abc=source['abc'])
+
+
+def _midi_varlen(n):
+    """Encode *n* as a MIDI variable-length quantity.
+    """
+    out = [n & 0x7f]
+    n >>= 7
+    while n > 0:
+        out.insert(0, (n & 0x7f) | 0x80)
+        n >>= 7
+    return bytes(bytearray(out))
+
+
+def write_midi(events, fh, bpm=120, division=480, channel=0):
+    """Write a sequence of NoteEvents to *fh* as a format 0 Standard MIDI File.
+
+    Events must be ordered by onset, as generated by Tune.events(). Messages
+    are written as events arrive; only the note-offs of sounding notes are
+    held in memory. The track length is patched into the chunk header at the
+    end; if *fh* is not seekable (a pipe or socket), the track is spooled to
+    a temporary file and copied to *fh* once its length is known.
+    """
+    import shutil, tempfile
+    fh.write(b'MThd' + struct.pack('>IHHH', 6, 0, 1, division))
+
+    seekable = getattr(fh, 'seekable', lambda: False)()
+    if seekable:
+        fh.write(b'MTrk')
+        len_pos = fh.tell()
+        fh.write(struct.pack('>I', 0))
+        out = fh
+    else:
+        out = tempfile.TemporaryFile()
+
+    # bytes written to the track, and tick of the last message
+    state = {'length': 0, 'now': 0}
+    def message(tick, data):
+        data = _midi_varlen(tick - state['now']) + data
+        out.write(data)
+        state['length'] += len(data)
+        state['now'] = tick
+
+    usec = int(round(60e6 / bpm))
+    message(0, b'\xff\x51\x03' + struct.pack('>I', usec)[1:])
+
+    note_offs = []
+    for ev in events:
+        on = int(round(ev.onset * division))
+        off = max(on + 1, int(round((ev.onset + ev.duration) * division)))
+        while note_offs and note_offs[0][0] <= on:
+            tick, pitch = heapq.heappop(note_offs)
+            message(tick, struct.pack('>BBB', 0x80 | channel, pitch, 0))
+        message(on, struct.pack('>BBB', 0x90 | channel, ev.pitch, ev.velocity))
+        heapq.heappush(note_offs, (off, ev.pitch))
+    while note_offs:
+        tick, pitch = heapq.heappop(note_offs)
+        message(tick, struct.pack('>BBB', 0x80 | channel, pitch, 0))
+    message(state['now'], b'\xff\x2f\x00')
+
+    if seekable:
+        end = fh.tell()
+        fh.seek(len_pos)
+        fh.write(struct.pack('>I', state['length']))
+        fh.seek(end)
+    else:
+        fh.write(b'MTrk' + struct.pack('>I', state['length']))
+        out.seek(0)
+        shutil.copyfileobj(out, fh, 2**16)
+        out.close()
 
 
 def get_thesession_tunes():
@@ -763,13 +2241,163 @@ def get_thesession_tunes():
     return json.loads(open('tunes.json', 'rb').read().decode('utf8'))
 
 
-if __name__ == '__main__':
-    ts_tunes = get_thesession_tunes()
-    for i,t in enumerate(ts_tunes):
-        print("----- %d: %s -----" % (i, t['name']))
-        tune = Tune(json=t)
+# Parse statistics for one tune recorded by profile_corpus(). size is an
+# estimate of the memory held by the tune's tokens and the objects they
+# reference, in bytes.
+TuneProfile = collections.namedtuple('TuneProfile', ['index', 'tune', 'setting', 'name', 'seconds',
+                                                     'n_tokens', 'size', 'error'])
+
+
+def _token_size(tokens):
+    # estimated bytes held by a token list: every object reachable from it
+    # through attributes and containers (the notes of chords and grace groups,
+    # token text, cached Pitch, Key and TimeSignature objects), counted once
+    seen = set()
+    stack = [tokens]
+    size = 0
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        size += sys.getsizeof(obj)
+        if isinstance(obj, dict):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple, set)):
+            stack.extend(obj)
+        elif hasattr(obj, '__dict__'):
+            stack.append(obj.__dict__)
+    return size
+
+
+def _failure_category(exc):
+    if isinstance(exc, ParseError):
+        return "unparsed %r" % exc.construct
+    return "%s: %s" % (exc.__class__.__name__, str(exc).split('\n')[0][:60])
+
+
+def profile_tune(index, data):
+    """Parse a TheSession json tune and return a TuneProfile.
+    """
+    import time
+    start = time.perf_counter()
+    tune, error = None, None
+    try:
+        tune = Tune(json=data)
+    except Exception as exc:
+        error = _failure_category(exc)
+    seconds = time.perf_counter() - start
+    n_tokens = 0 if tune is None else len(tune.tokens)
+    size = 0 if tune is None else _token_size(tune.tokens)
+    return TuneProfile(index, data.get('tune'), data.get('setting'), data.get('name'),
+                       seconds, n_tokens, size, error)
+
+
+def profile_corpus(corpus, top=20, capture=0, out=None):
+    """Parse every tune in *corpus* (a list of TheSession json dicts) and
+    write a report of the *top* slowest tunes and of parse failures grouped
+    by category to *out* (default sys.stdout).
+
+    The *capture* slowest tunes are parsed again under cProfile and
+    tracemalloc, and the busiest functions and allocation sites are added to
+    the report. Returns the list of TuneProfiles.
+    """
+    out = out or sys.stdout
+    profiles = [profile_tune(i, data) for i, data in enumerate(corpus)]
+    parsed = [p for p in profiles if p.error is None]
+    failed = [p for p in profiles if p.error is not None]
+    slowest = sorted(parsed, key=lambda p: p.seconds, reverse=True)
+
+    total = sum(p.seconds for p in profiles)
+    out.write("Parsed %d tunes in %.2f s (%d failed)\n" % (len(profiles), total, len(failed)))
+    if len(parsed) > 0:
+        out.write("Mean %.2f ms, %.0f tokens, %.0f kB (estimated) per tune\n" % (
+            1000 * sum(p.seconds for p in parsed) / len(parsed),
+            sum(p.n_tokens for p in parsed) / len(parsed),
+            sum(p.size for p in parsed) / len(parsed) / 1024))
+
+    out.write("\nSlowest tunes:\n")
+    out.write("  %6s %8s %8s %8s  %s\n" % ('ms', 'tokens', 'us/tok', 'est kB', 'tune'))
+    for p in slowest[:top]:
+        out.write("  %6.1f %8d %8.1f %8.1f  %s (%s setting %s) #%d\n" % (
+            1000 * p.seconds, p.n_tokens, 1e6 * p.seconds / max(p.n_tokens, 1), p.size / 1024,
+            p.name, p.tune, p.setting, p.index))
+
+    categories = {}
+    for p in failed:
+        categories.setdefault(p.error, []).append(p)
+    out.write("\nFailures by category:\n")
+    for error, group in sorted(categories.items(), key=lambda c: len(c[1]), reverse=True):
+        examples = ', '.join("#%d" % p.index for p in group[:5])
+        out.write("  %6d  %s  (e.g. %s)\n" % (len(group), error, examples))
+
+    for p in slowest[:capture]:
+        out.write("\n----- %s (#%d) -----\n" % (p.name, p.index))
+        _capture_profile(corpus[p.index], out)
+
+    return profiles
+
+
+def _capture_profile(data, out, limit=10):
+    # parse one tune under cProfile and tracemalloc and write the results
+    import cProfile, pstats, tracemalloc, io
+    prof = cProfile.Profile()
+    prof.runcall(Tune, json=data)
+    stream = io.StringIO()
+    pstats.Stats(prof, stream=stream).sort_stats('cumulative').print_stats(limit)
+    out.write(stream.getvalue())
+
+    tracemalloc.start()
+    try:
+        Tune(json=data)
+        snapshot = tracemalloc.take_snapshot()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    out.write("Peak traced memory: %.1f kB\n" % (peak / 1024))
+    for stat in snapshot.statistics('lineno')[:limit]:
+        out.write("  %s\n" % stat)
+
 
-    print("Header: %s" % tune.header)
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description="Parse the TheSession tune database.")
+    parser.add_argument('command', nargs='?', choices=['parse', 'profile'], default='parse',
+                        help="'profile' reports the slowest and failing tunes")
+    parser.add_argument('--top', type=int, default=20, help="number of slowest tunes to report")
+    parser.add_argument('--capture', type=int, default=0,
+                        help="profile this many of the slowest tunes with cProfile and tracemalloc")
+    parser.add_argument('--limit', type=int, default=None, help="only use the first LIMIT tunes")
+    parser.add_argument('--output', default=None, help="write the report to a file")
+    parser.add_argument('--db', default=None, help="store analysis results in this SQLite file")
+    args = parser.parse_args()
+
+    ts_tunes = get_thesession_tunes()[:args.limit]
+    if args.command == 'profile':
+        out = sys.stdout if args.output is None else open(args.output, 'w')
+        profile_corpus(ts_tunes, top=args.top, capture=args.capture, out=out)
+        if args.output is not None:
+            out.close()
+        sys.exit(0)
+
+    def parse_all():
+        for i,t in enumerate(ts_tunes):
+            print("----- %d: %s -----" % (i, t['name']))
+            try:
+                yield Tune(json=t)
+            except Exception as exc:
+                print("  failed: %s" % _failure_category(exc))
+
+    if args.db is not None:
+        store = ResultsStore(args.db)
+        n = store.add_tunes(parse_all())
+        print("Stored %d tunes in %s" % (n, args.db))
+        store.close()
+    else:
+        for tune in parse_all():
+            pass
+        print("Header: %s" % tune.header)
 
 
     def show(tune):
@@ -794,10 +2422,12 @@ if __name__ == '__main__':
         for token in tune.tokens:
             if isinstance(token, Beam):
                 plt.addLine(x=t)
-            elif isinstance(token, Note):
-                tvals.append(t)
-                yvals.append(token.pitch.abs_value)
-                t += token.duration
+            elif isinstance(token, (Note, Chord)):
+                t = token.onset / tune.resolution
+                for note in ([token] if isinstance(token, Note) else token.notes):
+                    tvals.append(t)
+                    yvals.append(note.pitch.abs_value)
+                t += token.ticks / tune.resolution
         plt.plot(tvals, yvals, pen=None, symbol='o')
 
 
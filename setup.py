@@ -24,4 +24,5 @@ setup(
     author='Campagnola',
     python_requires='>3.6',
     # @TODO install_requires=['peppercorn'],
+    extras_require={'ml': ['numpy', 'scipy']},  # FeatureExtractor
 )
@@ -0,0 +1,23 @@
+"""
+Shared fixtures for the test suite
+"""
+
+import pytest
+
+from pyabc import Tune, tunes
+
+
+@pytest.fixture
+def make_tune():
+    """Function building a Tune from an ABC body and a few header fields.
+    """
+    def make_tune(body, meter='4/4', unit='1/8', key='D', title='test'):
+        return Tune(abc="X:1\nT:%s\nM:%s\nL:%s\nK:%s\n%s\n" % (title, meter, unit, key, body))
+    return make_tune
+
+
+@pytest.fixture
+def corpus():
+    """The sample tunes in pyabc.tunes.
+    """
+    return [Tune(abc=abc) for abc in tunes]
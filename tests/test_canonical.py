@@ -0,0 +1,41 @@
+"""
+Tests for canonical tune forms and duplicate detection
+"""
+
+from pyabc import group_duplicates
+
+
+def test_canonical_symbols(make_tune):
+    tune = make_tune("|:ABcd ^f2 f2|(3efg a2 [F2D2] z2-|1 A8:|2 B8|]")
+    assert tune.canonical() == [
+        '|:', '9:1/8', '11:1/8', '13:1/8', '14:1/8', '18:1/4', '18:1/4', '|',
+        '16:1/12', '18:1/12', '19:1/12', '21:1/4', '[2,6]:1/4', 'z:1/4', '-', '|', '[1',
+        '9:1', ':|', '[2', '11:1', '|']
+
+
+def test_layout_does_not_change_hash(make_tune):
+    a = make_tune("ABcd ^f2 f2|(3efg a2 [D2F2] z2:|")
+    # different unit length, line breaks, comments, decorations and a
+    # redundant accidental
+    b = make_tune("% comment\nA/B/c/d/ !trill!^f ^f | \\\n (3e/f/g/ a [FD] z :|", unit='1/4')
+    assert a.canonical() == b.canonical()
+    assert a.content_hash == b.content_hash
+
+    c = make_tune("ABcd ^f2 =f2|(3efg a2 [D2F2] z2:|")
+    assert c.content_hash != a.content_hash
+
+    # a bar line before the first note is layout; a repeat sign is not
+    d = make_tune("|ABcd ^f2 f2|(3efg a2 [D2F2] z2:|")
+    assert d.content_hash == a.content_hash
+    e = make_tune("|:ABcd ^f2 f2|(3efg a2 [D2F2] z2:|")
+    assert e.content_hash != a.content_hash
+
+
+def test_group_duplicates(make_tune, corpus):
+    a = make_tune("ABcd efga|", title='a')
+    b = make_tune("A B c d e f g a |", title='b')
+    c = make_tune("ABcd efgb|", title='c')
+    groups = group_duplicates([a, b, c] + corpus)
+    assert len(groups) == 4
+    assert groups[a.content_hash] == [a, b]
+    assert groups[c.content_hash] == [c]
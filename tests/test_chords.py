@@ -0,0 +1,44 @@
+"""
+Tests for chord and grace note grouping
+"""
+
+from pyabc import Beam, GraceGroup
+
+
+def test_chord_tokens(make_tune):
+    tune = make_tune("A|[DF]2 {/g}A [CEG]/ {ag}f|[df]>[ce]|")
+    kinds = [t.__class__.__name__ for t in tune.tokens if not t.__class__.__name__ in ('Space', 'Newline')]
+    assert kinds == ['Note', 'Beam', 'Chord', 'GraceGroup', 'Note', 'Chord', 'GraceGroup', 'Note',
+                     'Beam', 'Chord', 'Chord', 'Beam']
+    chords = tune.chords
+    assert [c._text for c in chords] == ['[DF]2', '[CEG]/', '[df]', '[ce]']
+    assert [c.duration for c in chords] == [2, 0.5, 1.5, 0.5]
+    assert [n.pitch.name for n in chords[1].notes] == ['C#', 'E', 'G']
+    graces = [t for t in tune.tokens if isinstance(t, GraceGroup)]
+    assert graces[0].acciaccatura and not graces[1].acciaccatura
+    assert [t._text for t in tune.tokens if isinstance(t, Beam)] == ['|', '|', '|']
+
+
+def test_note_views(make_tune):
+    tune = make_tune("[DF]2 {ag}f [A,2C2E2]")
+    assert [n.pitch.name for n in tune.notes] == ['D', 'F#', 'F#', 'A', 'C#', 'E']
+    assert [n.pitch.name for n in tune.grace_notes] == ['A', 'G']
+    assert [(m.pitch, m.duration) for m in tune.melody] == [(6, 1), (18, 0.5), (4, 1)]
+    assert tune.pitchogram() == {2: 2, 6: 2, 18: 1, -3: 2, 1: 2, 4: 2}
+
+
+def test_chord_timing(make_tune):
+    tune = make_tune("[DF]2 (3[CE]AB c")
+    events = list(tune.events())
+    assert [(round(e.onset, 6), e.pitch) for e in events] == [
+        (0, 62), (0, 66), (1, 61), (1, 64), (round(1 + 1/3., 6), 69), (round(1 + 2/3., 6), 71), (2, 73)]
+    assert events[0].duration == 1
+
+
+def test_ties_and_decorations_inside_chords(make_tune):
+    tune = make_tune("[A-c] [Ac] [!ff!d.f]")
+    assert [t.__class__.__name__ for t in tune.tokens] == ['Chord', 'Space', 'Chord', 'Space', 'Chord', 'Newline']
+    assert [n.tied for n in tune.chords[0].notes] == [True, False]
+    events = list(tune.events())
+    assert sorted((e.onset, e.duration, e.pitch) for e in events[:3]) == [(0, 0.5, 73), (0, 1, 69), (0.5, 0.5, 73)]
+    assert events[-1].velocity == 112
@@ -0,0 +1,46 @@
+"""
+Tests for sparse melodic feature extraction
+"""
+
+import pytest
+
+from pyabc import Tune, FeatureExtractor
+
+scipy = pytest.importorskip('scipy')
+
+
+def test_feature_names():
+    tune = Tune(abc="X:1\nT:t\nM:4/4\nL:1/8\nK:C\nCDE2\n")
+    fx = FeatureExtractor(ngrams=(1, 2))
+    features = list(fx.features(tune.melody))
+    assert 'i:2,2' in features
+    assert 'c:u,u' in features
+    assert 'r:0.5,0.5,1' not in features
+    assert features.count('r:0.5') == 2
+
+
+def test_transform_chunked(corpus):
+    fx = FeatureExtractor()
+    matrix = fx.transform(corpus * 3, chunksize=2)
+    assert matrix.shape == (6, 2**20)
+    assert (matrix[0] != matrix[2]).nnz == 0
+    assert (matrix[0] != matrix[1]).nnz > 0
+
+    # counts agree with the feature generator
+    n = len(list(fx.features(corpus[0].melody)))
+    assert matrix[0].sum() == n
+
+
+def test_transform_processes(corpus):
+    fx = FeatureExtractor()
+    serial = fx.transform(corpus * 3, chunksize=2)
+    parallel = fx.transform(corpus * 3, chunksize=2, processes=2)
+    assert (serial != parallel).nnz == 0
+
+
+def test_vocabulary(corpus):
+    fx = FeatureExtractor(ngrams=(1,))
+    vocab = fx.fit_vocabulary(corpus)
+    matrix = fx.transform(corpus)
+    assert matrix.shape == (2, len(vocab))
+    assert matrix[0, vocab['c:u']] > 0
@@ -0,0 +1,54 @@
+"""
+Tests for windowed key detection
+"""
+
+from pyabc import Tune, rank_keys, tunes
+
+
+two_keys = """X:1
+T:Two keys
+M:4/4
+L:1/8
+K:D
+|:D2FA d2AF|G2BG A2FD|D2FA d2fe|dBAF D4:|
+|:E2BE dEBE|E2BE c2Bc|E2BE dEBd|cBAc B2E2:|
+"""
+
+
+def test_key_regions_by_part():
+    tune = Tune(abc=two_keys)
+    regions = tune.key_regions()
+    assert [(r.start, r.stop, repr(r.key)) for r in regions] == [
+        (0, 5, '<Key D major>'), (5, tune.n_bars, '<Key E dorian>')]
+
+
+def test_ambiguous_parts_stay_in_key():
+    for abc, key in zip(tunes, ['<Key E dorian>', '<Key E minor>']):
+        tune = Tune(abc=abc)
+        regions = tune.key_regions()
+        assert [repr(r.key) for r in regions] == [key]
+        assert (regions[0].start, regions[0].stop) == (0, tune.n_bars)
+
+
+def test_window_scores():
+    tune = Tune(abc=two_keys)
+    scores, total = tune.window_scores(1, 5)
+    assert total == 16
+    # every key is scored
+    assert len(scores) == 84
+    assert repr(tune.window_key(1, 5)) == '<Key D major>'
+    windows = tune.key_windows(2)
+    assert len(windows) == tune.n_bars - 1
+    assert repr(windows[6][1]) == '<Key E dorian>'
+
+
+def test_window_scores_match_direct_count():
+    tune = Tune(abc="X:1\nT:t\nM:4/4\nL:1/8\nK:D\nz8|D2FA d2AF|z8|G2BG A2FD|z8|\n")
+    for start in range(tune.n_bars):
+        for stop in range(start + 1, tune.n_bars + 1):
+            melody = [m for m in tune.melody if start <= m.bar < stop]
+            hist = [0] * 12
+            for m in melody:
+                hist[m.pitch % 12] += m.duration
+            tonics = [melody[0].pitch % 12, melody[-1].pitch % 12] if melody else []
+            assert tune.window_scores(start, stop) == (rank_keys(hist, tonics), sum(hist))
@@ -0,0 +1,51 @@
+"""
+Tests for motif search
+"""
+
+import random
+
+from pyabc import MotifIndex, _suffix_array
+
+
+def test_suffix_array():
+    text = [random.randint(0, 3) for i in range(300)]
+    assert _suffix_array(text) == sorted(range(300), key=lambda i: text[i:])
+    # symbols larger than the text length
+    text = [random.randint(0, 4095) for i in range(300)]
+    assert _suffix_array(text) == sorted(range(300), key=lambda i: text[i:])
+
+
+def test_find_rhythm_index(corpus):
+    index = MotifIndex.build(corpus, rhythm=True)
+    text = list(index.text)
+    for m in (1, 2, 3):
+        for i in range(len(text) - m + 1):
+            query = text[i:i+m]
+            expected = [j for j in range(len(text) - m + 1) if text[j:j+m] == query]
+            assert index.find(query) == expected
+
+
+def test_exact_search_any_key(corpus):
+    index = MotifIndex.build(corpus)
+    hits = index.search("EBBA")
+    assert [(h.tune, h.bar, h.token) for h in hits] == [(1, 0, 0), (1, 2, 26)]
+    # same phrase transposed up a whole step
+    assert index.search("^F^c^cB") == hits
+
+
+def test_mismatch_search(corpus):
+    index = MotifIndex.build(corpus)
+    exact = index.search("gfed")
+    fuzzy = index.search("gfed", mismatches=1)
+    assert set(exact) < set(h._replace(mismatches=0) for h in fuzzy)
+    assert all(h.mismatches <= 1 for h in fuzzy)
+
+
+def test_save_and_load(tmp_path, corpus):
+    index = MotifIndex.build(corpus, rhythm=True)
+    filename = str(tmp_path / 'motifs.idx')
+    index.save(filename)
+    loaded = MotifIndex.load(filename)
+    assert loaded.rhythm and len(loaded) == 2
+    assert loaded.search("E2BB2A") == index.search("E2BB2A")
+    assert loaded.search("ded", mismatches=1) == index.search("ded", mismatches=1)
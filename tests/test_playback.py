@@ -0,0 +1,97 @@
+"""
+Tests for note event generation and MIDI export
+"""
+
+import io
+import struct
+
+from pyabc import Tune, tunes
+
+
+def test_repeats_unrolled(make_tune):
+    tune = make_tune("|:A B c d:|e4 z4|]")
+    pitches = [ev.pitch for ev in tune.events()]
+    assert pitches == [69, 71, 73, 74, 69, 71, 73, 74, 76]
+
+
+def test_first_and_second_endings(make_tune):
+    tune = make_tune("|:A2 B2|1 c4:|2 d4|]")
+    pitches = [ev.pitch for ev in tune.events()]
+    assert pitches == [69, 71, 73, 69, 71, 74]
+
+
+def test_repeats_without_start(make_tune):
+    # a :| with no |: repeats from the previous repeat end
+    tune = make_tune("AB:|cd:|")
+    pitches = [ev.pitch for ev in tune.events()]
+    assert pitches == [69, 71, 69, 71, 73, 74, 73, 74]
+    tune = Tune(abc=tunes[1])
+    assert len(list(tune.events())) == 2 * len(tune.notes)
+
+
+def test_ties_tuplets_and_broken_rhythm(make_tune):
+    tune = make_tune("A2-A2 (3Bcd e>f")
+    events = list(tune.events())
+    assert [ev.pitch for ev in events] == [69, 71, 73, 74, 76, 78]
+    assert events[0].duration == 2
+    assert abs(events[1].duration - 1/3.) < 1e-9
+    assert abs(events[4].onset - 3) < 1e-9
+    assert events[4].duration == 0.75
+    assert events[5].duration == 0.25
+
+
+def test_bar_accidentals(make_tune):
+    # ^F carries through the bar; the bar line restores the key signature
+    tune = make_tune("^F F =F F|F", key='C')
+    assert [ev.pitch for ev in tune.events()] == [66, 66, 65, 65, 65]
+
+
+def test_chords_and_grace_notes(make_tune):
+    tune = make_tune("{g}[D2F2] A")
+    events = list(tune.events())
+    assert [(ev.onset, ev.pitch) for ev in events] == [(0, 62), (0, 66), (1, 69)]
+
+
+def test_write_midi(make_tune):
+    tune = make_tune("|:A B c d:|e4 z4|]")
+    fh = io.BytesIO()
+    tune.write_midi(fh)
+    data = fh.getvalue()
+    assert data[:4] == b'MThd'
+    assert data[14:18] == b'MTrk'
+    length = struct.unpack('>I', data[18:22])[0]
+    assert len(data) == 22 + length
+    assert data.endswith(b'\xff\x2f\x00')
+    assert data.count(b'\x90') == 9
+
+
+class WriteOnly(object):
+    """File-like object that cannot seek.
+    """
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+
+    @property
+    def data(self):
+        return b''.join(self.chunks)
+
+
+def test_write_midi_unseekable(make_tune):
+    tune = make_tune("|:A B c d:|e4 z4|]")
+    fh = io.BytesIO()
+    tune.write_midi(fh)
+    fh2 = WriteOnly()
+    tune.write_midi(fh2)
+    assert fh2.data == fh.getvalue()
+
+
+def test_write_midi_unseekable_streams(make_tune):
+    # the track is copied across in chunks, not written from one buffer
+    tune = make_tune("ABcd|" * 20000)
+    fh = WriteOnly()
+    tune.write_midi(fh)
+    assert len(fh.data) > 300000
+    assert max(len(c) for c in fh.chunks) <= 2**16
@@ -0,0 +1,48 @@
+"""
+Tests for the corpus profiling harness
+"""
+
+import io
+import tracemalloc
+
+import pytest
+
+from pyabc import Tune, ParseError, profile_corpus, _token_size
+
+
+corpus = [
+    dict(tune=1, setting=11, name='Good', meter='12/8', mode='Edorian', abc='E2B B2A|\r\nB2c d2A|'),
+    dict(tune=2, setting=12, name='Ampersand', meter='4/4', mode='Dmajor', abc='AB&c|'),
+    dict(tune=3, setting=13, name='Bad key', meter='4/4', mode='Hmajor', abc='AB|'),
+]
+
+
+def test_parse_error():
+    with pytest.raises(ParseError) as exc:
+        Tune(json=corpus[1])
+    assert exc.value.construct == '&'
+    assert (exc.value.line, exc.value.char) == (0, 2)
+    assert exc.value.url == 'http://thesession.org/tunes/2#setting12'
+
+
+def test_profile_corpus():
+    out = io.StringIO()
+    profiles = profile_corpus(corpus, capture=1, out=out)
+    assert [p.error is None for p in profiles] == [True, False, False]
+    assert profiles[0].n_tokens == 14 and profiles[0].size > 0
+    report = out.getvalue()
+    assert "unparsed '&'" in report
+    assert 'ValueError: Invalid key "Hmajor"' in report
+    assert 'Peak traced memory' in report
+
+
+def test_token_size_includes_chord_notes():
+    abc = "X:1\nT:t\nM:4/4\nL:1/8\nK:D\n" + "[DFA]2 [EGB]2 {ag}[F2A2d2] [GBd]2|\n" * 100
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        tune = Tune(abc=abc)
+        traced = tracemalloc.get_traced_memory()[0] - before
+    finally:
+        tracemalloc.stop()
+    assert 0.7 < _token_size(tune.tokens) / traced < 1.3
@@ -0,0 +1,54 @@
+"""
+Tests for the SQLite analysis results store
+"""
+
+from pyabc import Tune, ResultsStore, tunes
+
+
+thesession = [
+    dict(tune=10, setting=100, name='Slide', type='slide', meter='12/8', mode='Edorian',
+         abc='E2B B2A B2c d2A|F2A ABA D2E FED|\r\nE2B B2A B2c d3|cdc B2A B2E E3:|'),
+    dict(tune=11, setting=101, name='Reel', type='reel', meter='4/4', mode='Dmajor',
+         abc='DFAF GBAG|FAdA FAdf|'),
+]
+
+
+def make_store(tmp_path):
+    store = ResultsStore(str(tmp_path / 'results.db'))
+    tunes_in = [Tune(abc=abc) for abc in tunes] + [Tune(json=t) for t in thesession]
+    assert store.add_tunes(iter(tunes_in), batch_size=3) == 4
+    return store
+
+
+def test_store_rows(tmp_path):
+    store = make_store(tmp_path)
+    assert len(store) == 4
+    rows = list(store.query())
+    assert [r['title'] for r in rows] == ['The Road To Lisdoonvarna', 'The Kid On The Mountain', 'Slide', 'Reel']
+    assert rows[0]['key_root'] == 4 and rows[0]['key_mode'] == 'dorian'
+    assert rows[1]['key_mode'] == 'minor'
+    assert rows[0]['n_notes'] == 69
+    assert sum(rows[0]['pc%d' % i] for i in range(12)) > 0
+
+
+def test_store_queries(tmp_path):
+    store = make_store(tmp_path)
+    rows = store.query(key='Edor', meter='12/8', rhythm='slide')
+    assert [(r['reference'], r['setting']) for r in rows] == [(1, None), (10, 100)]
+    assert [r['title'] for r in store.query(key='Edorian', rhythm='slide', limit=1)] == ['The Road To Lisdoonvarna']
+    assert [r['title'] for r in store.query(detected_key='Emin')] == ['The Kid On The Mountain']
+    for row in store.query(mode_differs=True):
+        assert (row['key_root'], row['key_mode']) != (row['detected_root'], row['detected_mode'])
+
+
+def test_store_lazy_tunes(tmp_path):
+    store = make_store(tmp_path)
+    loaded = list(store.tunes(rhythm='reel'))
+    assert len(loaded) == 1
+    assert loaded[0].header['tune title'] == 'Reel'
+    assert [n.pitch.name for n in loaded[0].notes[:3]] == ['D', 'F#', 'A']
+    store.close()
+
+    # reopening uses the existing table
+    store = ResultsStore(str(tmp_path / 'results.db'))
+    assert len(store) == 4
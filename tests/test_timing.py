@@ -0,0 +1,51 @@
+"""
+Tests for exact tick timing
+"""
+
+from pyabc import Note, Rest, Chord
+
+
+def timed(tune):
+    return [t for t in tune.tokens if isinstance(t, (Note, Rest, Chord))]
+
+
+def test_lengths(make_tune):
+    tune = make_tune("A A2 A/ A// A3/ A/4 A>>B z>A")
+    assert [t.length for t in timed(tune)] == [(1, 1), (2, 1), (1, 2), (1, 4), (3, 2), (1, 4),
+                                               (7, 4), (1, 4), (3, 2), (1, 2)]
+
+
+def test_ticks_and_onsets(make_tune):
+    tune = make_tune("(3ABc d2 [DF] z | Z |")
+    assert tune.resolution == 24
+    tokens = timed(tune)
+    assert [t.ticks for t in tokens] == [2, 2, 2, 6, 3, 3, 24]
+    assert [t.onset for t in tokens] == [0, 2, 4, 6, 12, 15, 18]
+    assert [n.onset for n in tokens[4].notes] == [12, 12]
+    assert tune.melody[2].duration == 1 / 3.
+
+
+def test_no_drift(make_tune):
+    tune = make_tune("(3ABc " * 3000)
+    events = list(tune.events())
+    assert events[3].onset == 1
+    assert events[-3].onset == 2999
+
+
+def test_irregular_bars(make_tune):
+    tune = make_tune("A|B4 c4|d6|[M:3/4]e6|(3fga g4|]")
+    assert tune.irregular_bars() == [(0, 3, 24), (2, 18, 24)]
+
+
+def test_histograms_apply_tuplets(make_tune):
+    tune = make_tune("(3ABc d2|")
+    hist = tune.pitchogram()
+    assert [round(hist[v], 9) for v in (9, 11, 13, 14)] == [round(2 / 3., 9)] * 3 + [2]
+    pcs = tune.pitch_classes()
+    assert abs(pcs[9] - hist[9] / 2) < 1e-9
+
+
+def test_tuplets_per_voice(make_tune):
+    tune = make_tune("(3A[V:2]B c[V:1]B c d")
+    ticks = dict((v.id, [t.ticks for t in timed(v)]) for v in tune.voices.values())
+    assert ticks == {'1': [2, 2, 2, 3], '2': [3, 3]}
@@ -0,0 +1,78 @@
+"""
+Tests for per-voice token streams
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+
+from pyabc import Tune, Voice, tunes
+
+
+two_voices = """X:1
+T:Two voices
+M:4/4
+L:1/8
+V:1
+V:2
+K:G
+V:1
+GABc d4|e4 d4|
+V:2
+K:D
+G,2B,2 D4|C4 B,4|
+[V:1] g8|]
+[V:2] F8|]
+"""
+
+
+def test_voice_streams():
+    tune = Tune(abc=two_voices)
+    assert list(tune.voices.keys()) == ['1', '2']
+    melody, bass = tune.voices['1'], tune.voices['2']
+    assert isinstance(melody, Voice)
+    assert [n.pitch.name for n in melody.notes] == ['G', 'A', 'B', 'C', 'D', 'E', 'D', 'G']
+    # K:D applies only to the second voice
+    assert [n.pitch.name for n in bass.notes] == ['G', 'B', 'D', 'C#', 'B', 'F#']
+    assert melody.context.key.root.name == 'G'
+    assert bass.context.key.root.name == 'D'
+    assert len(tune.notes) == len(melody.notes) + len(bass.notes)
+
+
+def pitchogram(voice):
+    return voice.pitchogram()
+
+
+def test_voice_analyses():
+    tune = Tune(abc=two_voices)
+    assert [n.pitch for n in tune.melody] == [7, 9, 11, 12, 14, 16, 14, 19]
+    # indexes refer to Tune.tokens, bars to the bars of the voice
+    assert [tune.tokens[n.index].pitch.abs_value for n in tune.melody] == [7, 9, 11, 12, 14, 16, 14, 19]
+    assert [n.bar for n in tune.melody] == [0, 0, 0, 0, 0, 1, 1, 2]
+    assert tune.voices['1'].bar_index == [0, 8, 12, 17]
+    with ProcessPoolExecutor(2) as executor:
+        hists = tune.map_voices(pitchogram, executor)
+    assert hists == tune.map_voices(pitchogram)
+    assert hists['2'] == {-5: 2, -1: 6, 1: 4, 2: 4, 6: 8}
+
+
+def test_voice_events_merged():
+    tune = Tune(abc=two_voices)
+    onsets = [ev.onset for ev in tune.events()]
+    assert onsets == sorted(onsets)
+    assert len(onsets) == len(tune.notes)
+
+
+def test_single_voice():
+    tune = Tune(abc=tunes[0])
+    assert list(tune.voices.keys()) == ['1']
+    assert tune.voices['1'].tokens == tune.tokens
+
+
+def test_detect_key():
+    assert repr(Tune(abc=tunes[0]).detect_key()) == '<Key E dorian>'
+    assert repr(Tune(abc=tunes[1]).detect_key()) == '<Key E minor>'
+
+
+def test_unlabelled_body_uses_first_voice():
+    tune = Tune(abc="X:1\nT:t\nM:4/4\nL:1/8\nV:1\nV:2\nK:G\nGABc d4|\nV:2\nG,8|\n")
+    assert list(tune.voices.keys()) == ['1', '2']
+    assert [n.pitch.name for n in tune.voices['1'].notes] == ['G', 'A', 'B', 'C', 'D']